@@ -20,15 +20,19 @@
             'data/stage_data.xml',
             'data/mail_subtype_data.xml',
             'data/whatsapp_connection_data.xml',
+            'data/whatsapp_campaign_cron.xml',
             'views/connection_views.xml',
             'views/request_response_views.xml',
             'views/whatsapp_message_views.xml',
             'views/whatsapp_action.xml',
             'views/whatsapp_template_views.xml',
             'views/whatsapp_marketing_campaign_views.xml',
+            'views/whatsapp_campaign_trace_views.xml',
+            'views/whatsapp_campaign_stats_views.xml',
             'views/whatsapp_mailing_contact_views.xml',
             'views/whatsapp_mailing_list_views.xml',
             'views/whatsapp_mailing_contact_import_views.xml',
+            'views/whatsapp_blacklist_views.xml',
             'views/menu_views.xml',
             'views/res_users_views.xml',
             'wizard/whatsapp_compose_views.xml',
@@ -1,3 +1,4 @@
+from . import whatsapp_rate_limit
 from . import connection
 from . import request_response
 from . import chat_ui
@@ -9,9 +10,14 @@ from . import whatsapp_conversation
 from . import whatsapp_api_service
 from . import whatsapp_template
 from . import whatsapp_marketing_campaign
+from . import whatsapp_campaign_trace
+from . import whatsapp_campaign_stats
+from . import whatsapp_media_upload
+from . import whatsapp_compose_job
 from . import whatsapp_mailing_contact
 from . import whatsapp_mailing_list
 from . import whatsapp_mailing_subscription
+from . import whatsapp_blacklist
 from . import res_users
 from . import sale_order
 from . import purchase_order
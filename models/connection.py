@@ -1,15 +1,22 @@
-from odoo import models, fields, api, _
+from odoo import models, fields, api, _, sql_db
 from odoo.exceptions import ValidationError, UserError
+from odoo.tools import SQL
 import requests
 import logging
+import select
+import time
 from datetime import timedelta
 
 _logger = logging.getLogger(__name__)
 
+# PostgreSQL channel notified with the connection id when the frontend confirms its socket
+SOCKET_READY_CHANNEL = 'whatsapp_socket_ready'
+
 
 class WhatsAppConnection(models.Model):
     _name = 'whatsapp.connection'
     _description = 'WhatsApp Connection'
+    _inherit = ['whatsapp.rate.limit.mixin']
 
     name = fields.Char(string='Connection Name', required=True)
     from_field = fields.Char(string='From', required=True)
@@ -29,10 +36,10 @@ class WhatsAppConnection(models.Model):
         store=True,
         help="Users who have this connection as their default"
     )
-    socket_connection_ready = fields.Boolean(
-        default=False,
-        string="Socket Connected",
-        help="Flag set by frontend when socket connection is established"
+    rate_limit_concurrency = fields.Integer(
+        'Parallel Requests',
+        default=4,
+        help="Most requests sent to the WhatsApp service at the same time when a message goes to several recipients"
     )
     
     @api.constrains('is_default')
@@ -230,39 +237,9 @@ class WhatsAppConnection(models.Model):
             pass
         
         # STEP 1: Trigger socket connection FIRST (before REST call)
-        # This ensures socket is ready to receive QR updates
+        # This ensures socket is ready to receive QR updates (max 3 seconds)
         _logger.info(f"[Connection] Step 1: Triggering socket connection for {self.name}")
-        self._trigger_socket_connection(origin)
-        
-        # Clear ready flag and commit so frontend can set it
-        self.socket_connection_ready = False
-        self.env.cr.commit()
-        
-        # Wait for frontend confirmation that socket is connected (max 3 seconds)
-        import time
-        max_wait = 3
-        check_interval = 0.1
-        waited = 0
-        
-        _logger.info(f"[Connection] Waiting for socket connection confirmation...")
-        
-        # Use a fresh cursor to read the updated value
-        socket_confirmed = False
-        while waited < max_wait:
-            # Create new env to bypass cache
-            fresh_env = self.env(cr=self.env.cr)
-            fresh_record = fresh_env['whatsapp.connection'].browse(self.id)
-            fresh_record.invalidate_recordset(['socket_connection_ready'])
-            
-            if fresh_record.socket_connection_ready:
-                socket_confirmed = True
-                _logger.info(f"[Connection] Socket confirmed connected after {waited:.1f}s")
-                break
-            time.sleep(check_interval)
-            waited += check_interval
-        
-        if not socket_confirmed:
-            _logger.warning(f"[Connection] Socket not confirmed within {max_wait}s, proceeding anyway")
+        self._wait_socket_ready(origin, max_wait=3, context_name="Connection")
         
         # STEP 2: Make REST call (socket should be connected by now)
         api_url = "http://localhost:3000/api/whatsapp/qr"
@@ -380,21 +357,64 @@ class WhatsAppConnection(models.Model):
         }
         
         # Send bus notification to user's partner channel
-        # Frontend will receive this and connect/reconnect socket
+        # Frontend will receive this and connect/reconnect socket. It is sent from its own
+        # transaction so it reaches the browser now rather than when this request commits.
         try:
-            self.env['bus.bus']._sendone(
-                current_user.partner_id,
-                'whatsapp_connect_socket',
-                payload
-            )
+            with self.pool.cursor() as bus_cr:
+                self.env(cr=bus_cr)['bus.bus']._sendone(
+                    current_user.partner_id,
+                    'whatsapp_connect_socket',
+                    payload
+                )
             _logger.info(f"[Connection] Socket connection triggered for {self.name} (ID: {self.id})")
         except Exception as e:
             _logger.error(f"[Connection] Failed to send bus notification: {e}")
     
+    def _wait_socket_ready(self, origin, max_wait=2, context_name="Connection"):
+        """Trigger the frontend socket connection and wait until the frontend confirms it
+        
+        The request LISTENs on a PostgreSQL channel that confirm_socket_connected
+        notifies, so it wakes up as soon as the socket is connected, without
+        polling the database or committing its own transaction.
+        
+        Args:
+            origin: request origin, for socket matching
+            max_wait: maximum seconds to wait for the confirmation
+            context_name: name for logging context (e.g., "Campaign", "Wizard")
+        
+        Returns:
+            bool: True if the socket was confirmed within max_wait
+        """
+        self.ensure_one()
+        started = time.monotonic()
+        listen_cr = sql_db.db_connect(self.env.cr.dbname).cursor()
+        try:
+            # Listen before triggering, a confirmation sent in between is not missed
+            listen_cr.execute(SQL("LISTEN %s", SQL.identifier(SOCKET_READY_CHANNEL)))
+            listen_cr.commit()
+            cnx = listen_cr._cnx
+            self._trigger_socket_connection(origin)
+            
+            while True:
+                remaining = started + max_wait - time.monotonic()
+                if remaining <= 0:
+                    _logger.warning(f"[{context_name}] Socket not confirmed within {max_wait}s, proceeding anyway")
+                    return False
+                if not select.select([cnx], [], [], remaining)[0]:
+                    continue
+                cnx.poll()
+                while cnx.notifies:
+                    if cnx.notifies.pop(0).payload == str(self.id):
+                        _logger.info(f"[{context_name}] Socket confirmed connected after {time.monotonic() - started:.1f}s")
+                        return True
+        finally:
+            listen_cr.execute(SQL("UNLISTEN %s", SQL.identifier(SOCKET_READY_CHANNEL)))
+            listen_cr.commit()
+            listen_cr.close()
+
     def confirm_socket_connected(self):
-        """Called by frontend when socket is connected - releases the wait lock"""
+        """Called by frontend when socket is connected - wakes up the requests waiting for it"""
         self.ensure_one()
-        # Force commit to make it visible immediately
-        self.socket_connection_ready = True
-        self.env.cr.commit()  # Commit immediately so Python can see it
+        # Delivered to the listeners when this call commits
+        self.env.cr.execute("SELECT pg_notify(%s, %s)", [SOCKET_READY_CHANNEL, str(self.id)])
         _logger.info(f"[Connection] Socket connection confirmed for {self.name} (ID: {self.id})")
\ No newline at end of file
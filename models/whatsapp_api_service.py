@@ -13,7 +13,7 @@ _logger = logging.getLogger(__name__)
 class WhatsAppAPIService(models.Model):
     _name = 'whatsapp.api.service'
     _description = 'WhatsApp API Service'
-    _inherit = ['mail.thread']
+    _inherit = ['mail.thread', 'whatsapp.rate.limit.mixin']
 
     name = fields.Char('Service Name', required=True)
     api_token = fields.Char('API Token', required=True)
@@ -109,6 +109,9 @@ class WhatsAppAPIService(models.Model):
             # Prepare message payload
             payload = self._prepare_message_payload(to_phone, message_content, message_type, media_data)
             
+            # Pace sends through the shared per-service token bucket
+            self._wait_send_token(context_name="API Service")
+            
             response = requests.post(url, headers=headers, json=payload, timeout=30)
             
             if response.status_code == 200:
@@ -276,12 +279,12 @@ class WhatsAppAPIService(models.Model):
                         
                         for message_data in messages:
                             self._process_incoming_message(message_data, value.get('contacts', [{}])[0])
-                            
-                            # Update message status
-                            if 'statuses' in value:
-                                statuses = value.get('statuses', [])
-                                for status_data in statuses:
-                                    self._process_message_status(status_data)
+                    
+                    # Update message status
+                    if 'statuses' in value:
+                        statuses = value.get('statuses', [])
+                        for status_data in statuses:
+                            self._process_message_status(status_data)
             
             return {'success': True}
             
@@ -341,6 +344,9 @@ class WhatsAppAPIService(models.Model):
             message_id = status_data.get('id')
             status = status_data.get('status')
             
+            # Campaign messages update their trace and the campaign statistics
+            self.env['whatsapp.campaign.trace']._record_delivery_status(message_id, status)
+            
             # Find message by external ID
             message = self.env['whatsapp.message'].search([('message_id', '=', message_id)], limit=1)
             
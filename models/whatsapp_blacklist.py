@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+import re
+
+
+class WhatsAppBlacklist(models.Model):
+    """Phone numbers that must never receive WhatsApp campaigns"""
+    _name = 'whatsapp.blacklist'
+    _description = 'WhatsApp Blacklist'
+    _inherit = ['mail.thread']
+    _order = 'id desc'
+    _rec_name = 'phone'
+
+    phone = fields.Char('Phone', required=True, tracking=True, help='Phone number (e.g., +91 9157000128)')
+    phone_sanitized = fields.Char(
+        'Sanitized Phone',
+        compute='_compute_phone_sanitized',
+        store=True,
+        index=True,
+        help="Digits of the phone number, matched against campaign recipients"
+    )
+    reason = fields.Text('Reason')
+    active = fields.Boolean('Active', default=True, tracking=True)
+
+    _sql_constraints = [
+        ('phone_sanitized_unique', 'UNIQUE(phone_sanitized)', 'This phone number is already blacklisted!'),
+    ]
+
+    @api.model
+    def _sanitize_phone(self, phone):
+        """Keep only the digits, the form recipients are compared on in SQL"""
+        return re.sub(r'\D', '', phone or '')
+
+    @api.depends('phone')
+    def _compute_phone_sanitized(self):
+        for record in self:
+            record.phone_sanitized = self._sanitize_phone(record.phone) or False
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Normalize phone numbers before creating, reactivating archived entries of the same number"""
+        for vals in vals_list:
+            if vals.get('phone'):
+                vals['phone'] = self.env['whatsapp.mailing.contact']._normalize_phone(vals['phone'])
+
+        sanitized = [self._sanitize_phone(vals.get('phone')) for vals in vals_list]
+        archived = {
+            entry.phone_sanitized: entry
+            for entry in self.with_context(active_test=False).search([
+                ('phone_sanitized', 'in', [phone for phone in sanitized if phone]),
+                ('active', '=', False),
+            ])
+        }
+        entries = [archived.pop(phone, None) for phone in sanitized]
+        for vals, entry in zip(vals_list, entries):
+            if entry:
+                entry.write(dict(vals, active=True))
+        created = iter(super().create([vals for vals, entry in zip(vals_list, entries) if not entry]))
+        # Keep the order of vals_list, as create does
+        return self.browse([(entry or next(created)).id for entry in entries])
+
+    def write(self, vals):
+        """Normalize phone number before writing"""
+        if vals.get('phone'):
+            vals['phone'] = self.env['whatsapp.mailing.contact']._normalize_phone(vals['phone'])
+        return super().write(vals)
+
+    def action_unblacklist(self):
+        self.write({'active': False})
+        return True
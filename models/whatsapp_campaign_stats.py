@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+import bisect
+import json
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the delivery latency histogram buckets, the last one catches everything slower
+LATENCY_BUCKETS = (1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 21600, 86400)
+
+
+class WhatsAppCampaignStats(models.Model):
+    """Hourly rollup of campaign outcomes, one row per campaign and hour of sending
+
+    Rows are updated incrementally by atomic upserts as messages are sent
+    and as delivery/read receipts arrive, so reports read a few rows per
+    campaign instead of scanning the messages. Receipts are counted in the
+    hour their message was sent, so each row follows the messages sent
+    during that hour.
+
+    Whenever the campaign counters are recounted from the traces, the rows
+    of the campaign are rebuilt from the traces as well, so requeued and
+    recovered messages never leave the rollup apart from the counters.
+    """
+    _name = 'whatsapp.campaign.stats'
+    _description = 'WhatsApp Campaign Statistics'
+    _order = 'campaign_id, hour'
+    _rec_name = 'hour'
+
+    campaign_id = fields.Many2one(
+        'whatsapp.marketing.campaign',
+        string='Campaign',
+        required=True,
+        index=True,
+        ondelete='cascade'
+    )
+    hour = fields.Datetime('Hour', required=True, readonly=True, help="Hour the messages were sent in")
+    sent_count = fields.Integer('Sent', readonly=True)
+    delivered_count = fields.Integer('Delivered', readonly=True)
+    read_count = fields.Integer('Read', readonly=True)
+    failed_count = fields.Integer('Failed', readonly=True)
+    latency_histogram = fields.Json('Latency Histogram', readonly=True)
+    latency_median = fields.Float(
+        'Median Delivery Time (s)',
+        readonly=True,
+        group_operator='avg',
+        help="Median seconds between sending and delivery, from the latency histogram"
+    )
+
+    _sql_constraints = [
+        ('campaign_hour_unique', 'UNIQUE(campaign_id, hour)', 'Statistics are kept once per campaign and hour!'),
+    ]
+
+    @api.model
+    def _hour_of(self, value):
+        return value.replace(minute=0, second=0, microsecond=0)
+
+    @api.model
+    def _add(self, campaign_id, when, sent=0, delivered=0, read=0, failed=0, latency=None):
+        """Add outcomes to the row of a campaign and hour in one atomic upsert
+
+        Args:
+            campaign_id: id of the campaign
+            when: datetime the messages were sent at, counted in its hour
+            sent / delivered / read / failed: counts to add
+            latency: delivery latency in seconds of one delivered message, if any
+        """
+        if not (sent or delivered or read or failed):
+            return
+        bucket = None
+        if latency is not None:
+            index = min(bisect.bisect_left(LATENCY_BUCKETS, max(latency, 0)), len(LATENCY_BUCKETS) - 1)
+            bucket = str(LATENCY_BUCKETS[index])
+        now = fields.Datetime.now()
+        self.env.cr.execute("""
+            INSERT INTO whatsapp_campaign_stats AS stats
+                (campaign_id, hour, sent_count, delivered_count, read_count, failed_count, latency_histogram,
+                 create_uid, create_date, write_uid, write_date)
+            VALUES (%(campaign)s, %(hour)s, %(sent)s, %(delivered)s, %(read)s, %(failed)s, %(histogram)s::jsonb,
+                    %(uid)s, %(now)s, %(uid)s, %(now)s)
+            ON CONFLICT (campaign_id, hour) DO UPDATE
+            SET sent_count = stats.sent_count + EXCLUDED.sent_count,
+                delivered_count = stats.delivered_count + EXCLUDED.delivered_count,
+                read_count = stats.read_count + EXCLUDED.read_count,
+                failed_count = stats.failed_count + EXCLUDED.failed_count,
+                latency_histogram = CASE WHEN %(bucket)s IS NULL THEN stats.latency_histogram
+                    ELSE COALESCE(stats.latency_histogram, '{}'::jsonb) || jsonb_build_object(
+                        %(bucket)s::text, COALESCE((stats.latency_histogram ->> %(bucket)s::text)::int, 0) + 1)
+                    END,
+                write_uid = EXCLUDED.write_uid, write_date = EXCLUDED.write_date
+            RETURNING id, latency_histogram
+        """, {
+            'campaign': campaign_id,
+            'hour': self._hour_of(when),
+            'sent': sent,
+            'delivered': delivered,
+            'read': read,
+            'failed': failed,
+            'histogram': json.dumps({bucket: 1}) if bucket else None,
+            'bucket': bucket,
+            'uid': self.env.uid,
+            'now': now,
+        })
+        stats_id, histogram = self.env.cr.fetchone()
+        if bucket:
+            self.env.cr.execute(
+                "UPDATE whatsapp_campaign_stats SET latency_median = %s WHERE id = %s",
+                [self._histogram_median(histogram), stats_id]
+            )
+        self.invalidate_model()
+
+    @api.model
+    def _recount(self, campaign_ids):
+        """Rebuild the rows of campaigns from their traces, the source of truth
+
+        Sent messages and receipts are counted in the hour of sent_at and
+        failures in the hour of failed_at, as _add counts them while sending.
+        """
+        if not campaign_ids:
+            return
+        now = fields.Datetime.now()
+        self.env.cr.execute("""
+            WITH outcomes AS (
+                SELECT campaign_id, date_trunc('hour', sent_at) AS hour,
+                       COUNT(*) FILTER (WHERE state = 'sent') AS sent,
+                       COUNT(delivered_at) AS delivered,
+                       COUNT(read_at) AS read,
+                       0 AS failed
+                FROM whatsapp_campaign_trace
+                WHERE campaign_id IN %(campaigns)s AND sent_at IS NOT NULL
+                GROUP BY 1, 2
+                UNION ALL
+                SELECT campaign_id, date_trunc('hour', failed_at), 0, 0, 0, COUNT(*)
+                FROM whatsapp_campaign_trace
+                WHERE campaign_id IN %(campaigns)s AND state IN ('failed', 'dead') AND failed_at IS NOT NULL
+                GROUP BY 1, 2
+            ), latencies AS (
+                SELECT campaign_id, hour, jsonb_object_agg(bucket::text, messages) AS histogram
+                FROM (
+                    SELECT campaign_id, date_trunc('hour', sent_at) AS hour,
+                           COALESCE(
+                               (SELECT MIN(bound) FROM unnest(%(buckets)s::int[]) AS bound
+                                WHERE bound >= EXTRACT(EPOCH FROM delivered_at - sent_at)),
+                               %(last_bucket)s
+                           ) AS bucket,
+                           COUNT(*) AS messages
+                    FROM whatsapp_campaign_trace
+                    WHERE campaign_id IN %(campaigns)s AND sent_at IS NOT NULL AND delivered_at IS NOT NULL
+                    GROUP BY 1, 2, 3
+                ) buckets
+                GROUP BY 1, 2
+            ), totals AS (
+                SELECT campaign_id, hour, SUM(sent) AS sent, SUM(delivered) AS delivered,
+                       SUM(read) AS read, SUM(failed) AS failed
+                FROM outcomes
+                GROUP BY 1, 2
+            )
+            INSERT INTO whatsapp_campaign_stats AS stats
+                (campaign_id, hour, sent_count, delivered_count, read_count, failed_count, latency_histogram,
+                 create_uid, create_date, write_uid, write_date)
+            SELECT totals.campaign_id, totals.hour, totals.sent, totals.delivered, totals.read, totals.failed,
+                   latencies.histogram, %(uid)s, %(now)s, %(uid)s, %(now)s
+            FROM totals
+            LEFT JOIN latencies ON latencies.campaign_id = totals.campaign_id AND latencies.hour = totals.hour
+            ON CONFLICT (campaign_id, hour) DO UPDATE
+            SET sent_count = EXCLUDED.sent_count,
+                delivered_count = EXCLUDED.delivered_count,
+                read_count = EXCLUDED.read_count,
+                failed_count = EXCLUDED.failed_count,
+                latency_histogram = EXCLUDED.latency_histogram,
+                write_uid = EXCLUDED.write_uid, write_date = EXCLUDED.write_date
+            RETURNING id, latency_histogram
+        """, {
+            'campaigns': tuple(campaign_ids),
+            'buckets': list(LATENCY_BUCKETS),
+            'last_bucket': LATENCY_BUCKETS[-1],
+            'uid': self.env.uid,
+            'now': now,
+        })
+        rows = self.env.cr.fetchall()
+        # Hours left without any message since the last count, e.g. failures requeued and sent later
+        self.env.cr.execute(
+            "DELETE FROM whatsapp_campaign_stats WHERE campaign_id IN %s AND NOT (id = ANY(%s::int[]))",
+            [tuple(campaign_ids), [stats_id for stats_id, _histogram in rows]]
+        )
+        for stats_id, histogram in rows:
+            self.env.cr.execute(
+                "UPDATE whatsapp_campaign_stats SET latency_median = %s WHERE id = %s",
+                [self._histogram_median(histogram) if histogram else 0.0, stats_id]
+            )
+        self.invalidate_model()
+
+    @api.model
+    def _histogram_median(self, histogram):
+        """Median latency of a histogram, as the upper bound of the bucket holding the middle value"""
+        if isinstance(histogram, str):
+            histogram = json.loads(histogram)
+        counts = sorted((int(bound), count) for bound, count in (histogram or {}).items())
+        total = sum(count for _bound, count in counts)
+        seen = 0
+        for bound, count in counts:
+            seen += count
+            if seen * 2 >= total:
+                return float(bound)
+        return 0.0
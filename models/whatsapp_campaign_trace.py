@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+from datetime import timedelta
+from psycopg2.errors import SerializationFailure
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# Minutes after which a message still marked in flight is considered interrupted
+INTERRUPTED_AFTER_MINUTES = 10
+
+# Transient failures are retried with a capped exponential backoff before going to the dead letter state
+MAX_SEND_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 3600
+
+
+class WhatsAppCampaignTrace(models.Model):
+    """One queued outbound message of a campaign (one row per recipient)"""
+    _name = 'whatsapp.campaign.trace'
+    _description = 'WhatsApp Campaign Trace'
+    _order = 'id'
+    _rec_name = 'phone'
+
+    campaign_id = fields.Many2one(
+        'whatsapp.marketing.campaign',
+        string='Campaign',
+        required=True,
+        index=True,
+        ondelete='cascade'
+    )
+    connection_id = fields.Many2one(
+        'whatsapp.connection',
+        string='Sender',
+        index=True,
+        ondelete='set null',
+        help="Connection this message is sent from"
+    )
+    phone = fields.Char('Phone', required=True, help='Normalized phone number frozen when the campaign started')
+    contact_name = fields.Char('Contact Name')
+    res_model = fields.Char('Source Model', readonly=True)
+    res_id = fields.Many2oneReference('Source Record', model_field='res_model', readonly=True)
+    state = fields.Selection([
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        ('dead', 'Dead Letter'),
+    ], string='Status', default='queued', required=True, index=True,
+        help="Failed: permanent error, not retried. Dead Letter: transient error still failing after every retry.")
+    attempt_count = fields.Integer('Attempts', default=0, readonly=True)
+    next_attempt_at = fields.Datetime(
+        'Next Attempt',
+        index=True,
+        readonly=True,
+        help="Queued retries are not sent before this time"
+    )
+    message_id = fields.Char('Message ID', index=True, readonly=True, help='External message ID returned by the WhatsApp service')
+    sent_at = fields.Datetime('Sent At', readonly=True)
+    delivered_at = fields.Datetime('Delivered At', readonly=True)
+    read_at = fields.Datetime('Read At', readonly=True)
+    failed_at = fields.Datetime('Failed At', readonly=True)
+    error = fields.Text('Error')
+
+    _sql_constraints = [
+        ('campaign_phone_unique', 'UNIQUE(campaign_id, phone)', 'A phone number can only be queued once per campaign!'),
+    ]
+
+    @api.model
+    def _is_transient_failure(self, result):
+        """Whether a failed send may succeed later: timeout, service unreachable, throttling or server error"""
+        status = result.get('status_code')
+        if status is None:
+            return bool(result.get('transport_error'))
+        return status == 429 or status >= 500
+
+    def _schedule_retry(self, error):
+        """Queue the traces again after a backoff, or move them to the dead letter state
+        
+        Returns:
+            recordset: the traces moved to the dead letter state
+        """
+        now = fields.Datetime.now()
+        dead = self.browse()
+        for trace in self:
+            attempts = trace.attempt_count + 1
+            if attempts >= MAX_SEND_ATTEMPTS:
+                dead |= trace
+                trace.write({'state': 'dead', 'attempt_count': attempts, 'failed_at': now, 'error': error})
+                continue
+            delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+            trace.write({
+                'state': 'queued',
+                'attempt_count': attempts,
+                'next_attempt_at': now + timedelta(seconds=delay),
+                'error': error,
+            })
+        return dead
+
+    def action_requeue(self):
+        """Queue failed and dead letter traces again and restart their campaigns"""
+        traces = self.filtered(lambda t: t.state in ('failed', 'dead'))
+        if not traces:
+            return True
+        traces.write({
+            'state': 'queued',
+            'attempt_count': 0,
+            'next_attempt_at': False,
+            'failed_at': False,
+            'error': False,
+        })
+        campaigns = traces.campaign_id
+        campaigns._recount_counters()
+        campaigns.filtered(lambda c: c.state == 'sent').write({'state': 'sending'})
+        if campaigns.filtered(lambda c: c.state == 'sending'):
+            campaigns._trigger_dispatch()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Messages Requeued'),
+                'message': _('%s messages queued again') % len(traces),
+                'type': 'success',
+            }
+        }
+
+    @api.model
+    def _claim_queued(self, campaign, connection, limit):
+        """Mark up to `limit` due queued traces of a campaign and sender as in flight, and commit
+        
+        Rows are picked with FOR UPDATE SKIP LOCKED, so dispatchers running in
+        several workers or on several servers never claim the same message:
+        rows another worker is claiming are skipped, and a batch claimed by
+        another worker since this transaction started is left to it.
+        
+        Returns:
+            recordset: the claimed traces, in queue order
+        """
+        now = fields.Datetime.now()
+        try:
+            with self.env.cr.savepoint():
+                self.env.cr.execute("""
+                    UPDATE whatsapp_campaign_trace
+                    SET state = 'sending', write_uid = %(uid)s, write_date = %(now)s
+                    WHERE id IN (
+                        SELECT id FROM whatsapp_campaign_trace
+                        WHERE campaign_id = %(campaign)s
+                          AND connection_id IS NOT DISTINCT FROM %(connection)s
+                          AND state = 'queued'
+                          AND (next_attempt_at IS NULL OR next_attempt_at <= %(now)s)
+                        ORDER BY id
+                        LIMIT %(limit)s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id
+                """, {
+                    'uid': self.env.uid,
+                    'now': now,
+                    'campaign': campaign.id,
+                    'connection': connection.id or None,
+                    'limit': limit,
+                })
+                trace_ids = sorted(row[0] for row in self.env.cr.fetchall())
+        except SerializationFailure:
+            trace_ids = []
+        # Commit even an empty claim: the next one starts from a fresh snapshot
+        self.env.cr.commit()
+        self.invalidate_model(['state', 'write_uid', 'write_date'])
+        return self.browse(trace_ids)
+
+    @api.model
+    def _record_delivery_status(self, message_id, status):
+        """Record a delivery or read receipt of a campaign message on its trace and in the stats rollup
+        
+        Only the first receipt of each kind is counted, so webhooks delivered
+        more than once do not inflate the statistics.
+        
+        Returns:
+            bool: True if the message belongs to a campaign
+        """
+        if not message_id or status not in ('delivered', 'read'):
+            return False
+        now = fields.Datetime.now()
+        self.env.cr.execute("""
+            UPDATE whatsapp_campaign_trace trace
+            SET delivered_at = COALESCE(trace.delivered_at, %(now)s),
+                read_at = CASE WHEN %(read)s THEN COALESCE(trace.read_at, %(now)s) ELSE trace.read_at END
+            FROM (
+                SELECT id, delivered_at, read_at FROM whatsapp_campaign_trace
+                WHERE message_id = %(message_id)s
+                FOR UPDATE
+            ) previous
+            WHERE trace.id = previous.id
+            RETURNING trace.campaign_id, trace.sent_at, trace.delivered_at,
+                      previous.delivered_at IS NULL, %(read)s AND previous.read_at IS NULL
+        """, {'now': now, 'read': status == 'read', 'message_id': message_id})
+        rows = self.env.cr.fetchall()
+        
+        Stats = self.env['whatsapp.campaign.stats']
+        for campaign_id, sent_at, delivered_at, first_delivery, first_read in rows:
+            latency = (delivered_at - sent_at).total_seconds() if first_delivery and sent_at else None
+            Stats._add(campaign_id, sent_at or now, delivered=int(first_delivery), read=int(first_read), latency=latency)
+        if rows:
+            self.invalidate_model(['delivered_at', 'read_at'])
+        return bool(rows)
+
+    @api.model
+    def _recover_interrupted(self):
+        """Close traces left in flight by a crashed or killed dispatcher run
+        
+        The request may or may not have reached WhatsApp, so they are marked
+        failed rather than queued again: a resumed campaign never sends twice.
+        """
+        limit = fields.Datetime.now() - timedelta(minutes=INTERRUPTED_AFTER_MINUTES)
+        traces = self.search([('state', '=', 'sending'), ('write_date', '<', limit)])
+        if traces:
+            _logger.warning(f"[Campaign] Marking {len(traces)} interrupted messages as failed")
+            traces.write({
+                'state': 'failed',
+                'failed_at': fields.Datetime.now(),
+                'error': _("Interrupted while sending, delivery status unknown"),
+            })
+            traces.campaign_id._recount_counters()
+        return traces
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api, _
+from datetime import timedelta
+from ..tools.cron import cron_time_budget
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Longest a single job cron run may spend sending before it reschedules itself,
+# shortened to stay under the worker's cron time limit
+JOB_TIME_BUDGET = 240
+
+# Minutes after which a job still marked running is considered interrupted
+JOB_INTERRUPTED_AFTER_MINUTES = 30
+
+
+class WhatsAppComposeJob(models.Model):
+    """Messages of the compose wizard sent in the background to several partners"""
+    _name = 'whatsapp.compose.job'
+    _description = 'WhatsApp Compose Job'
+    _order = 'id'
+
+    state = fields.Selection([
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('paused', 'Waiting Authentication'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string='Status', default='queued', required=True, index=True)
+    connection_id = fields.Many2one(
+        'whatsapp.connection',
+        string='From Number',
+        required=True,
+        ondelete='cascade'
+    )
+    partner_ids = fields.Many2many(
+        'res.partner', 'whatsapp_compose_job_res_partner_rel',
+        'job_id', 'partner_id', string='Recipients')
+    done_partner_ids = fields.Many2many(
+        'res.partner', 'whatsapp_compose_job_done_partner_rel',
+        'job_id', 'partner_id', string='Processed Recipients',
+        help="Recipients already sent or failed, skipped when the job resumes")
+    total_count = fields.Integer('Recipients Total', help="Recipients of the compose, including those sent before queueing")
+    subject = fields.Char('Subject')
+    body = fields.Html('Message Content', sanitize=False)
+    attachment_ids = fields.Many2many(
+        'ir.attachment', 'whatsapp_compose_job_ir_attachments_rel',
+        'job_id', 'attachment_id', string='Attachments')
+    res_model = fields.Char('Related Document Model')
+    res_id = fields.Many2oneReference('Related Document ID', model_field='res_model')
+    origin = fields.Char('Origin', help="Request origin of the compose, reused for socket matching")
+    success_count = fields.Integer('Sent', default=0)
+    error_count = fields.Integer('Failed', default=0)
+    error_messages = fields.Text('Errors')
+
+    def _trigger(self):
+        """Schedule a run of the compose job cron"""
+        self.env.ref('whatsapp_chat_module.ir_cron_whatsapp_compose_job')._trigger()
+
+    @api.model
+    def _cron_process(self):
+        """Send queued compose jobs within a bounded time budget
+        
+        A job still sending when the budget runs out is queued again and
+        resumes with its remaining recipients in the next run. Each job is
+        processed at most once per run, so a job waiting for send tokens
+        is not claimed over and over until the deadline.
+        """
+        deadline = time.monotonic() + cron_time_budget(JOB_TIME_BUDGET)
+        self._recover_interrupted()
+        processed = []
+        while time.monotonic() < deadline:
+            job = self._claim_next(processed)
+            if not job:
+                return
+            processed.append(job.id)
+            job._process(deadline)
+        self._trigger()
+
+    @api.model
+    def _claim_next(self, skip_ids=()):
+        """Mark the oldest queued job as running and commit - FOR UPDATE SKIP LOCKED keeps workers apart
+        
+        Args:
+            skip_ids: ids of jobs not to claim, already processed in this run
+        """
+        self.env.cr.execute("""
+            UPDATE whatsapp_compose_job
+            SET state = 'running', write_date = %s
+            WHERE id = (
+                SELECT id FROM whatsapp_compose_job
+                WHERE state = 'queued' AND id != ALL(%s::int[])
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id
+        """, [fields.Datetime.now(), list(skip_ids)])
+        row = self.env.cr.fetchone()
+        self.env.cr.commit()
+        self.invalidate_model(['state'])
+        return self.browse(row[0]) if row else self.browse()
+
+    @api.model
+    def _recover_interrupted(self):
+        """Queue again the jobs of a killed run, they resume after their last processed recipient"""
+        limit = fields.Datetime.now() - timedelta(minutes=JOB_INTERRUPTED_AFTER_MINUTES)
+        jobs = self.search([('state', '=', 'running'), ('write_date', '<', limit)])
+        if jobs:
+            _logger.warning(f"⚠️ [Compose Job] Resuming {len(jobs)} interrupted jobs")
+            jobs.write({'state': 'queued'})
+            self.env.cr.commit()
+        return jobs
+
+    def _process(self, deadline=None):
+        """Send the job's remaining messages through a compose wizard run as the requesting user
+        
+        The job is queued again whenever recipients are left, whether the
+        deadline or the rate limit stopped the wizard, and waits for the QR
+        code to be scanned when the WhatsApp session was lost.
+        
+        Args:
+            deadline: time.monotonic() value after which no new message is sent,
+                      the job is then queued again with the recipients left
+        """
+        self.ensure_one()
+        partners = self.partner_ids - self.done_partner_ids
+        _logger.info(f"📤 [Compose Job {self.id}] Sending to {len(partners)} recipients")
+        wizard = self.env['whatsapp.chat.simple.wizard'].with_user(self.create_uid).with_context(
+            active_model=self.res_model,
+            active_id=self.res_id,
+            compose_job_id=self.id,
+            compose_job_deadline=deadline,
+        ).create({
+            'subject': self.subject or _('WhatsApp Message'),
+            'body': self.body,
+            'from_number': self.connection_id.id,
+            'partner_ids': [(6, 0, self.partner_ids.ids)],
+            'attachment_ids': [(6, 0, self.attachment_ids.ids)],
+        })
+        try:
+            result = wizard._send_messages_via_socket(self.origin or '127.0.0.1', partners=partners)
+        except Exception as e:
+            _logger.exception(f"❌ [Compose Job {self.id}] Sending failed: {e}")
+            self.env.cr.rollback()
+            self._finish(str(e))
+            return
+
+        if result.get('qr_popup_needed'):
+            # Session lost: the recipients left are sent once the QR code is scanned
+            self.write({'state': 'paused'})
+            self._send_progress(error=_("WhatsApp authentication is required, scan the QR code to resume sending"))
+            self.env.cr.commit()
+            return
+        if self.partner_ids - self.done_partner_ids:
+            # Out of time or of send tokens: the next run sends the recipients left
+            self.write({'state': 'queued'})
+            self.env.cr.commit()
+            self._trigger()
+            return
+        if self.success_count:
+            wizard._log_in_chatter([partner.name for partner in self.partner_ids], [])
+        self._finish()
+
+    def _resume(self):
+        """Queue again jobs paused for authentication, once the QR code is scanned"""
+        jobs = self.filtered(lambda job: job.state == 'paused')
+        if jobs:
+            jobs.write({'state': 'queued'})
+            jobs._trigger()
+        return jobs
+
+    def _notify_result(self, partner, error=None):
+        """Count one recipient's outcome, mark it processed and push it to the requesting user over the bus"""
+        self.ensure_one()
+        values = {'done_partner_ids': [(4, partner.id)]}
+        if error:
+            values.update({
+                'error_count': self.error_count + 1,
+                'error_messages': '\n'.join(filter(None, [self.error_messages, error])),
+            })
+        else:
+            values['success_count'] = self.success_count + 1
+        self.write(values)
+        self._send_progress(partner=partner, error=error)
+        self.env.cr.commit()
+
+    def _finish(self, error=None):
+        """Close the job and send its summary, with the error that stopped it if any"""
+        self.ensure_one()
+        values = {'state': 'failed' if error else 'done'}
+        if error:
+            values['error_messages'] = '\n'.join(filter(None, [self.error_messages, error]))
+        self.write(values)
+        self._send_progress(error=error, done=True)
+        self.env.cr.commit()
+        _logger.info(f"✅ [Compose Job {self.id}] {self.success_count} sent, {self.error_count} failed")
+
+    def _send_progress(self, partner=None, error=None, done=False):
+        self.ensure_one()
+        partner_channel = self.create_uid.partner_id
+        if not partner_channel:
+            return
+        self.env['bus.bus']._sendone(partner_channel, 'whatsapp_compose_progress', {
+            'job_id': self.id,
+            'title': self.subject or _('WhatsApp'),
+            'partner': partner.name if partner else False,
+            'error': error or False,
+            'sent': self.success_count,
+            'failed': self.error_count,
+            'total': self.total_count,
+            'done': done,
+            'errors': (self.error_messages or '').splitlines() if done else [],
+        })
@@ -23,6 +23,12 @@ class WhatsAppMailingSubscription(models.Model):
         ondelete='cascade',
         required=True
     )
+    opt_out = fields.Boolean(
+        'Opted Out',
+        default=False,
+        index=True,
+        help="The contact asked to stop receiving campaigns sent to this list"
+    )
 
     _sql_constraints = [
         ('unique_contact_list', 'unique (contact_id, list_id)',
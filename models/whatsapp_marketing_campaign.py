@@ -1,20 +1,41 @@
 # -*- coding: utf-8 -*-
 
 from odoo import models, fields, api, _
+from odoo.addons.base.models.res_partner import _tz_get
 from odoo.exceptions import UserError
+from odoo.tools import SQL, format_datetime
+from psycopg2.errors import LockNotAvailable, SerializationFailure
+from psycopg2.extras import execute_values
+from ..tools import html_to_whatsapp_text, node_client
+from ..tools.cron import cron_request_timeout, cron_time_budget
+from ..tools.node_client import BULK_SEND_MAX
+from .whatsapp_campaign_trace import INTERRUPTED_AFTER_MINUTES
 import logging
 import requests
 import re
 import json
+from ast import literal_eval
 import base64
 import io
 from bs4 import BeautifulSoup
-from datetime import timedelta
+from datetime import datetime, time as dt_time, timedelta
+import itertools
+import pytz
 import time
-import random
 
 _logger = logging.getLogger(__name__)
 
+# Longest a single dispatcher cron run may spend sending before it reschedules itself,
+# shortened to stay under the worker's cron time limit
+DISPATCH_TIME_BUDGET = 240
+
+# Recipients read and queued per chunk when freezing the audience
+RECIPIENT_CHUNK_SIZE = 10000
+
+# Campaign progress is pushed to the bus every N messages or every N seconds, whichever comes first
+PROGRESS_NOTIFY_EVERY = 25
+PROGRESS_NOTIFY_SECONDS = 10
+
 
 class WhatsAppMarketingCampaign(models.Model):
     _name = 'whatsapp.marketing.campaign'
@@ -26,7 +47,9 @@ class WhatsAppMarketingCampaign(models.Model):
     name = fields.Char('Campaign Name', required=True, tracking=True)
     state = fields.Selection([
         ('draft', 'Draft'),
+        ('scheduled', 'Scheduled'),
         ('sending', 'Sending'),
+        ('paused', 'Paused'),
         ('sent', 'Sent')
     ], string='Status', default='draft', required=True, tracking=True)
     
@@ -101,6 +124,28 @@ class WhatsAppMarketingCampaign(models.Model):
         help="WhatsApp connection to send messages from"
     )
     
+    sender_mode = fields.Selection([
+        ('single', 'Single Connection'),
+        ('pool', 'Connection Pool'),
+    ], string='Senders', default='single', required=True,
+        help="Send from the main connection only, or spread recipients over a pool of connections")
+    
+    sender_connection_ids = fields.Many2many(
+        'whatsapp.connection',
+        'whatsapp_campaign_sender_connection_rel',
+        'campaign_id',
+        'connection_id',
+        string='Additional Connections',
+        domain=lambda self: self._get_authorized_connection_domain(),
+        help="Connections sending alongside the main connection in pool mode"
+    )
+    
+    sender_distribution = fields.Selection([
+        ('round_robin', 'Round Robin'),
+        ('weighted', 'Weighted by Sending Rate'),
+    ], string='Distribution', default='round_robin', required=True,
+        help="How recipients are split over the pool: evenly, or proportionally to each connection's messages per minute")
+    
     template_id = fields.Many2one(
         'whatsapp.template',
         string='Load Template',
@@ -109,7 +154,8 @@ class WhatsAppMarketingCampaign(models.Model):
     
     body = fields.Text(
         'Campaign Body',
-        help="Message content to send (plain text)"
+        help="Message content to send (plain text). Placeholders such as {{ object.name }} are "
+             "rendered for each recipient record."
     )
     
     attachment_ids = fields.Many2many(
@@ -131,14 +177,98 @@ class WhatsAppMarketingCampaign(models.Model):
     sent_count = fields.Integer(
         'Sent',
         default=0,
+        readonly=True,
+        copy=False,
         help="Number of messages sent successfully"
     )
     
     failed_count = fields.Integer(
         'Failed',
         default=0,
+        readonly=True,
+        copy=False,
         help="Number of messages that failed to send"
     )
+    
+    queued_count = fields.Integer(
+        'Queued',
+        compute='_compute_trace_counts',
+        help="Number of messages still waiting to be sent"
+    )
+
+    delivered_count = fields.Integer(
+        'Delivered',
+        compute='_compute_statistics',
+        help="Number of messages delivered, from the hourly statistics"
+    )
+    
+    read_count = fields.Integer(
+        'Read',
+        compute='_compute_statistics',
+        help="Number of messages read, from the hourly statistics"
+    )
+
+    stats_ids = fields.One2many(
+        'whatsapp.campaign.stats',
+        'campaign_id',
+        string='Statistics',
+        readonly=True
+    )
+
+    trace_ids = fields.One2many(
+        'whatsapp.campaign.trace',
+        'campaign_id',
+        string='Recipients Queue',
+        readonly=True,
+        help="One queued message per recipient, processed by the dispatcher cron"
+    )
+
+    dispatch_origin = fields.Char(
+        'Dispatch Origin',
+        readonly=True,
+        help="Request origin captured when the campaign was sent, reused by the dispatcher for socket matching"
+    )
+
+    dispatch_user_id = fields.Many2one(
+        'res.users',
+        string='Dispatched By',
+        readonly=True,
+        copy=False,
+        help="User who sent or scheduled the campaign, the dispatcher renders personalized messages with their rights"
+    )
+
+    scheduled_at = fields.Datetime(
+        'Scheduled At',
+        copy=False,
+        tracking=True,
+        help="When the dispatcher starts sending a scheduled campaign"
+    )
+
+    use_send_window = fields.Boolean(
+        'Restrict Send Hours',
+        help="Only send during the daily window below; the campaign pauses when the window "
+             "closes and resumes when it opens again"
+    )
+
+    send_window_start = fields.Float(
+        'Send From',
+        default=20.0,
+        help="Hour of the day the send window opens, in the window's timezone"
+    )
+
+    send_window_end = fields.Float(
+        'Send Until',
+        default=8.0,
+        help="Hour of the day the send window closes, in the window's timezone. "
+             "An end before the start spans midnight, e.g. 20:00 to 08:00"
+    )
+
+    send_window_tz = fields.Selection(
+        _tz_get,
+        string='Timezone',
+        default=lambda self: self.env.user.tz or 'UTC',
+        help="Timezone of the send window hours"
+    )
 
     @api.model
     def _get_authorized_connection_domain(self):
@@ -160,6 +290,22 @@ class WhatsAppMarketingCampaign(models.Model):
         
         return result
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        self._check_dynamic_body([vals.get('body') for vals in vals_list])
+        return super().create(vals_list)
+
+    def write(self, vals):
+        if 'body' in vals:
+            self._check_dynamic_body([vals['body']])
+        return super().write(vals)
+
+    @api.model
+    def _check_dynamic_body(self, bodies):
+        """Keep placeholders, evaluated by the dispatcher cron, to template editors"""
+        if any(body and '{{' in body for body in bodies) and not self._can_edit_dynamic_body():
+            raise UserError(_("Only template editors can use placeholders ({{ ... }}) in a campaign body"))
+
     @api.depends('mailing_model_id')
     def _compute_mailing_model_real(self):
         """Compute the real model to use for recipients"""
@@ -188,114 +334,202 @@ class WhatsAppMarketingCampaign(models.Model):
 
     @api.depends('whatsapp_list_ids', 'mailing_model_id', 'mailing_domain', 'mailing_on_mailing_list')
     def _compute_total_recipients(self):
-        """Count unique contacts with phone numbers"""
+        """Count unique contacts with phone numbers (the frozen snapshot once the campaign started)"""
+        snapshot_counts = dict(self.env['whatsapp.campaign.trace']._read_group(
+            [('campaign_id', 'in', self._origin.ids)], ['campaign_id'], ['__count']
+        ))
         for campaign in self:
-            if not campaign.mailing_model_real:
+            if campaign._origin in snapshot_counts:
+                campaign.total_recipients = snapshot_counts[campaign._origin]
+                continue
+            recipient_sql = campaign._get_recipient_query()
+            if recipient_sql is None:
                 campaign.total_recipients = 0
                 continue
-            
-            # Get records based on mailing lists or domain
-            if campaign.mailing_on_mailing_list:
-                if not campaign.whatsapp_list_ids:
-                    campaign.total_recipients = 0
-                    continue
-                # Get all contacts from selected WhatsApp mailing lists
-                records = self.env['whatsapp.mailing.contact'].search([
-                    ('list_ids', 'in', campaign.whatsapp_list_ids.ids)
-                ])
-            else:
-                # Use domain to get records
-                if not campaign.mailing_domain:
-                    campaign.total_recipients = 0
-                    continue
-                try:
-                    from ast import literal_eval
-                    domain = literal_eval(campaign.mailing_domain) if campaign.mailing_domain else []
-                except:
-                    domain = []
-                records = self.env[campaign.mailing_model_real].search(domain)
-            
-            # Count records with phone numbers
-            count = 0
-            for record in records:
-                phone = self._get_phone_from_record(record)
-                if phone:
-                    count += 1
-            
-            campaign.total_recipients = count
-
-    def _get_phone_from_record(self, record):
-        """Extract phone number from a record (contact, partner, etc.)"""
-        # Try whatsapp.mailing.contact first
-        if record._name == 'whatsapp.mailing.contact':
-            if hasattr(record, 'mobile') and record.mobile:
-                return record.mobile
-            # elif record.partner_id:
-            #     return record.partner_id.mobile or record.partner_id.phone
-        # Try mailing.contact
-        # elif record._name == 'mailing.contact':
-        #     if hasattr(record, 'mobile') and record.mobile:
-        #         return record.mobile
-            # elif hasattr(record, 'phone') and record.phone:
-            #     return record.phone
-            # elif record.partner_id:
-            #     return record.partner_id.mobile or record.partner_id.phone
-        # Try res.partner
-        elif record._name == 'res.partner':
-            return record.mobile or record.phone
-        # Try other models with mobile/phone fields
-        else:
-            if hasattr(record, 'mobile') and record.mobile:
-                return record.mobile
-            elif hasattr(record, 'phone') and record.phone:
-                return record.phone
-            # elif hasattr(record, 'partner_id') and record.partner_id:
-            #     return record.partner_id.mobile or record.partner_id.phone
-        return None
-
-    def _get_recipients(self):
-        """Get all phone numbers from mailing lists or domain"""
+            self.env.cr.execute(SQL("SELECT COUNT(*) FROM (%s) AS recipients", recipient_sql))
+            campaign.total_recipients = self.env.cr.fetchone()[0]
+
+    @api.depends('trace_ids.state')
+    def _compute_trace_counts(self):
+        """Count messages still waiting to be sent"""
+        counts = dict(self.env['whatsapp.campaign.trace']._read_group(
+            [('campaign_id', 'in', self.ids), ('state', 'in', ['queued', 'sending'])], ['campaign_id'], ['__count']
+        ))
+        for campaign in self:
+            campaign.queued_count = counts.get(campaign, 0)
+
+    @api.depends('stats_ids.delivered_count', 'stats_ids.read_count')
+    def _compute_statistics(self):
+        """Sum the delivered/read counts of the hourly rollup"""
+        totals = {
+            campaign: (delivered, read)
+            for campaign, delivered, read in self.env['whatsapp.campaign.stats']._read_group(
+                [('campaign_id', 'in', self.ids)], ['campaign_id'], ['delivered_count:sum', 'read_count:sum']
+            )
+        }
+        for campaign in self:
+            campaign.delivered_count, campaign.read_count = totals.get(campaign, (0, 0))
+
+    def action_view_statistics(self):
+        """Open the hourly statistics of the campaign"""
         self.ensure_one()
-        recipients = []
+        action = self.env['ir.actions.actions']._for_xml_id('whatsapp_chat_module.action_whatsapp_campaign_stats')
+        action['domain'] = [('campaign_id', '=', self.id)]
+        action['context'] = {'default_campaign_id': self.id}
+        return action
+
+    def action_view_traces(self):
+        """Open the messages of the campaign, read page by page rather than embedded in the form"""
+        self.ensure_one()
+        action = self.env['ir.actions.actions']._for_xml_id('whatsapp_chat_module.action_whatsapp_campaign_trace')
+        action['domain'] = [('campaign_id', '=', self.id)]
+        action['context'] = {'default_campaign_id': self.id}
+        return action
+
+    def _increment_counters(self, sent=0, failed=0):
+        """Add to the sent/failed counters in one atomic UPDATE
         
+        Concurrent workers add their own deltas instead of writing back a value
+        they read earlier, so no update is lost and the row lock is held only
+        for the statement. The same deltas feed the hourly statistics.
+        """
+        if not self or not (sent or failed):
+            return
+        self.env.cr.execute("""
+            UPDATE whatsapp_marketing_campaign
+            SET sent_count = sent_count + %s, failed_count = failed_count + %s
+            WHERE id IN %s
+        """, [sent, failed, tuple(self.ids)])
+        self.invalidate_recordset(['sent_count', 'failed_count'])
+        now = fields.Datetime.now()
+        for campaign in self:
+            self.env['whatsapp.campaign.stats']._add(campaign.id, now, sent=sent, failed=failed)
+
+    def _recount_counters(self):
+        """Reset the sent/failed counters and the hourly statistics from the traces, the source of truth"""
+        if not self:
+            return
+        self.env.cr.execute("""
+            UPDATE whatsapp_marketing_campaign campaign
+            SET sent_count = (
+                    SELECT COUNT(*) FROM whatsapp_campaign_trace trace
+                    WHERE trace.campaign_id = campaign.id AND trace.state = 'sent'
+                ),
+                failed_count = (
+                    SELECT COUNT(*) FROM whatsapp_campaign_trace trace
+                    WHERE trace.campaign_id = campaign.id AND trace.state IN ('failed', 'dead')
+                )
+            WHERE campaign.id IN %s
+        """, [tuple(self.ids)])
+        self.invalidate_recordset(['sent_count', 'failed_count'])
+        self.env['whatsapp.campaign.stats']._recount(self.ids)
+
+    def _get_recipient_query(self):
+        """Build the SQL selecting (res_id, name, phone) of every recipient with a phone number
+        
+        The phone is the first non-empty of the model's stored mobile/phone
+        columns and the name falls back to the related partner's name, so
+        recipients are resolved in the database without loading records.
+        Blacklisted numbers and contacts who opted out of the campaign's
+        lists are excluded by anti-joins in the same query.
+        
+        Returns:
+            SQL: the recipient query, or None if the campaign has no recipient source
+        """
+        self.ensure_one()
         if not self.mailing_model_real:
-            return recipients
+            return None
         
         # Get records based on mailing lists or domain
         if self.mailing_on_mailing_list:
             if not self.whatsapp_list_ids:
-                return recipients
-            # Get all contacts from selected WhatsApp mailing lists
-            records = self.env['whatsapp.mailing.contact'].search([
-                ('list_ids', 'in', self.whatsapp_list_ids.ids)
-            ])
+                return None
+            domain = []
         else:
-            # Use domain to get records
             if not self.mailing_domain:
-                return recipients
+                return None
             try:
-                from ast import literal_eval
-                domain = literal_eval(self.mailing_domain) if self.mailing_domain else []
-            except:
+                domain = literal_eval(self.mailing_domain)
+            except Exception:
                 domain = []
-            records = self.env[self.mailing_model_real].search(domain)
-        
-        for record in records:
-            phone = self._get_phone_from_record(record)
-            if phone:
-                # Get name
-                contact_name = 'Unknown'
-                if hasattr(record, 'name') and record.name:
-                    contact_name = record.name
-                elif hasattr(record, 'partner_id') and record.partner_id and record.partner_id.name:
-                    contact_name = record.partner_id.name
-                
-                recipients.append({
-                    'phone': phone.strip(),
-                    'name': contact_name
-                })
         
-        return recipients
+        Model = self.env[self.mailing_model_real]
+        phone_fields = [
+            fname for fname in ('mobile', 'phone')
+            if fname in Model._fields and Model._fields[fname].store and Model._fields[fname].type == 'char'
+        ]
+        if not phone_fields:
+            return None
+        
+        query = Model._search(domain)
+        query.order = None
+        alias = query.table
+        
+        phone_sql = SQL("COALESCE(%s)", SQL(", ").join(
+            SQL("NULLIF(TRIM(%s), '')", SQL.identifier(alias, fname)) for fname in phone_fields
+        ))
+        
+        name_parts = []
+        name_field = Model._fields.get('name')
+        if name_field and name_field.store and name_field.type == 'char' and not name_field.translate:
+            name_parts.append(SQL("NULLIF(%s, '')", SQL.identifier(alias, 'name')))
+        partner_field = Model._fields.get('partner_id')
+        if partner_field and partner_field.store and partner_field.comodel_name == 'res.partner':
+            name_parts.append(SQL(
+                "(SELECT partner.name FROM res_partner partner WHERE partner.id = %s)",
+                SQL.identifier(alias, 'partner_id'),
+            ))
+        name_parts.append(SQL("%s", 'Unknown'))
+        
+        query.add_where(SQL("%s IS NOT NULL", phone_sql))
+        if self.mailing_on_mailing_list:
+            # Subscribed to one of the lists without having opted out of it
+            query.add_where(SQL(
+                """EXISTS (
+                    SELECT 1 FROM whatsapp_mailing_subscription sub
+                    WHERE sub.contact_id = %s AND sub.list_id = ANY(%s) AND sub.opt_out IS NOT TRUE
+                )""",
+                SQL.identifier(alias, 'id'), self.whatsapp_list_ids._origin.ids,
+            ))
+        # Blacklisted numbers are suppressed by an anti-join on the indexed sanitized phone
+        query.add_where(SQL(
+            """NOT EXISTS (
+                SELECT 1 FROM whatsapp_blacklist bl
+                WHERE bl.active AND bl.phone_sanitized = regexp_replace(%s, '[^0-9]', '', 'g')
+            )""",
+            phone_sql,
+        ))
+        return query.select(
+            SQL("%s AS res_id", SQL.identifier(alias, 'id')),
+            SQL("COALESCE(%s) AS name", SQL(", ").join(name_parts)),
+            SQL("%s AS phone", phone_sql),
+        )
+
+    def _iter_recipient_chunks(self, chunk_size=RECIPIENT_CHUNK_SIZE):
+        """Yield the (res_id, name, phone) recipient rows in chunks of chunk_size
+        
+        Chunks are read with keyset pagination on the record id, so each query
+        seeks on the primary key instead of skipping an offset, and memory
+        stays flat whatever the audience size.
+        """
+        self.ensure_one()
+        recipient_sql = self._get_recipient_query()
+        if recipient_sql is None:
+            return
+        
+        last_id = 0
+        while True:
+            self.env.cr.execute(SQL(
+                "SELECT res_id, name, phone FROM (%s) AS recipients WHERE res_id > %s ORDER BY res_id LIMIT %s",
+                recipient_sql, last_id, chunk_size,
+            ))
+            rows = self.env.cr.fetchall()
+            if not rows:
+                return
+            yield rows
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1][0]
 
     @api.onchange('mailing_model_id')
     def _onchange_mailing_model_id(self):
@@ -317,7 +551,11 @@ class WhatsAppMarketingCampaign(models.Model):
             # Load template body (plain text from HTML)
             if self.template_id.body_html:
                 soup = BeautifulSoup(self.template_id.body_html, 'html.parser')
-                self.body = soup.get_text(separator=' ')
+                if self.template_id.model == self.mailing_model_real:
+                    # Keep the template's dynamic values as placeholders rendered per recipient
+                    for node in soup.find_all(attrs={'t-out': True}):
+                        node.replace_with(f"{{{{ {node['t-out']} }}}}")
+                self.body = html_to_whatsapp_text(str(soup))
             else:
                 self.body = ''
         else:
@@ -338,10 +576,86 @@ class WhatsAppMarketingCampaign(models.Model):
         }
 
     def action_send(self):
-        """Send campaign - make REST API call, handle QR if needed"""
+        """Send campaign - queue recipients, send the first one to handle QR if needed"""
         self.ensure_one()
+        self._check_sendable()
+        
+        if not self._is_in_send_window():
+            # Outside the send hours: queue now, the dispatcher starts when the window opens
+            self._lock_for_send()
+            self._queue_recipients()
+            self.write({'dispatch_origin': self._get_origin(), 'dispatch_user_id': self.env.uid})
+            self._pause_dispatch()
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'title': _('Campaign Queued'),
+                    'message': _('Campaign queued for %s recipients, sending starts at %s') % (
+                        self.total_recipients, self._format_local(self._next_send_window_start())),
+                    'type': 'success',
+                }
+            }
+        
+        # STEP 1: Ensure socket is connected with each sender connection's credentials
+        for connection in self._get_sender_connections():
+            self._ensure_socket_connected(connection=connection, context_name="Campaign")
+        
+        # STEP 2: Queue recipients, unless an interrupted run left messages in the queue
+        Trace = self.env['whatsapp.campaign.trace']
+        self._lock_for_send()
+        self._queue_recipients()
+        self.write({'dispatch_origin': self._get_origin(), 'dispatch_user_id': self.env.uid})
+        
+        # Send to first recipient to check authentication
+        first_trace = Trace.search([('campaign_id', '=', self.id), ('state', '=', 'queued')], limit=1)
+        first_body = None
+        render_errors = {}
+        if first_trace.res_id and self._is_personalized():
+            bodies, render_errors = self._render_bodies([first_trace.res_id])
+            first_body = bodies[first_trace.res_id]
+        
+        if first_body is not None and not first_body.strip():
+            # Nothing to send to this recipient, the dispatcher checks the authentication with the next one
+            self._fail_unrendered(first_trace, render_errors)
+            self._increment_counters(failed=1)
+        else:
+            (first_trace.connection_id or self.from_connection_id)._wait_send_token(context_name="Campaign")
+            first_result = self._send_trace(first_trace, body=first_body)
+            
+            # If QR popup needed, return it
+            if first_result.get('qr_popup_needed'):
+                return {
+                    'type': 'ir.actions.act_window',
+                    'name': 'WhatsApp Authentication Required',
+                    'res_model': 'whatsapp.qr.popup',
+                    'res_id': first_result.get('qr_popup_id'),
+                    'view_mode': 'form',
+                    'view_id': self.env.ref('whatsapp_chat_module.whatsapp_qr_popup_view').id,
+                    'target': 'new',
+                }
+            
+            if not first_result.get('success'):
+                raise UserError(_("Failed to send: %s") % first_result.get('error', 'Unknown error'))
+            self._increment_counters(sent=1)
         
-        # Validate
+        # The dispatcher cron sends the remaining recipients
+        self.write({'state': 'sending'})
+        self._trigger_dispatch()
+        
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Campaign Queued'),
+                'message': _('Campaign queued for %s recipients, messages are sent in the background') % self.total_recipients,
+                'type': 'success',
+            }
+        }
+
+    def _check_sendable(self):
+        """Check the campaign can be sent and the user may use its connections"""
+        self.ensure_one()
         if not self.body:
             raise UserError(_("Please enter campaign body"))
         if not self.mailing_model_id:
@@ -360,90 +674,745 @@ class WhatsAppMarketingCampaign(models.Model):
             raise UserError(_("Please set a domain to filter recipients"))
         if not self.from_connection_id:
             raise UserError(_("Please select a connection"))
+        if self._is_personalized() and not self._can_edit_dynamic_body():
+            raise UserError(_("Only template editors can send campaigns with placeholders ({{ ... }}) in their body"))
         
         # Check authorization
-        if not self.from_connection_id._check_authorization():
-            raise UserError(_("You are not authorized to use this connection."))
+        for connection in self._get_sender_connections():
+            if not connection._check_authorization():
+                raise UserError(_("You are not authorized to use the connection %s.") % connection.name)
+
+    def _lock_for_send(self):
+        """Lock the campaign row until the end of the transaction
         
-        # STEP 1: Ensure socket is connected with selected connection's credentials
-        self._ensure_socket_connected(context_name="Campaign")
+        Two users pressing Send at the same time would otherwise both queue
+        the audience and send the first message. The second one fails fast
+        instead of waiting for the first.
+        """
+        self.ensure_one()
+        try:
+            with self.env.cr.savepoint():
+                self.env.cr.execute(
+                    "SELECT state FROM whatsapp_marketing_campaign WHERE id = %s FOR UPDATE NOWAIT", [self.id]
+                )
+                state = self.env.cr.fetchone()[0]
+        except (LockNotAvailable, SerializationFailure):
+            raise UserError(_("This campaign is already being sent by another user."))
+        if state != 'draft':
+            raise UserError(_("This campaign has already been sent or scheduled."))
+
+    def _queue_recipients(self):
+        """Snapshot the audience, unless an interrupted run left messages in the queue"""
+        self.ensure_one()
+        Trace = self.env['whatsapp.campaign.trace']
+        if not Trace.search_count([('campaign_id', '=', self.id), ('state', '=', 'queued')]):
+            if not self._snapshot_recipients():
+                raise UserError(_("No valid phone numbers found in selected mailing lists"))
+        self._recount_counters()
+
+    def action_schedule(self):
+        """Schedule the campaign - the dispatcher cron queues and sends it at scheduled_at"""
+        self.ensure_one()
+        self._check_sendable()
+        if not self.scheduled_at:
+            raise UserError(_("Please set the date to send the campaign at"))
+        if self.scheduled_at <= fields.Datetime.now():
+            raise UserError(_("The scheduled date must be in the future, use Send to send the campaign now"))
         
-        # STEP 2: Get recipients and send messages (socket should be ready for QR events)
-        recipients = self._get_recipients()
-        if not recipients:
-            raise UserError(_("No valid phone numbers found in selected mailing lists"))
+        self.write({
+            'state': 'scheduled',
+            'dispatch_origin': self._get_origin(),
+            'dispatch_user_id': self.env.uid,
+        })
+        self._trigger_dispatch(at=self.scheduled_at)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Campaign Scheduled'),
+                'message': _('Campaign scheduled for %s') % self._format_local(self.scheduled_at),
+                'type': 'success',
+            }
+        }
+
+    def action_cancel_schedule(self):
+        """Put a scheduled campaign back to draft"""
+        self.filtered(lambda c: c.state == 'scheduled').write({'state': 'draft'})
+        return True
+
+    def _is_in_send_window(self, now=None):
+        """Whether the campaign may send at `now` (UTC, defaults to the current time)"""
+        self.ensure_one()
+        if not self.use_send_window or self.send_window_start == self.send_window_end:
+            return True
+        now = now or fields.Datetime.now()
+        local = pytz.utc.localize(now).astimezone(pytz.timezone(self.send_window_tz or 'UTC'))
+        hour = local.hour + local.minute / 60.0 + local.second / 3600.0
+        start, end = self.send_window_start, self.send_window_end
+        if start < end:
+            return start <= hour < end
+        # The window spans midnight, e.g. 20:00 to 08:00
+        return hour >= start or hour < end
+
+    def _next_send_window_start(self, now=None):
+        """UTC datetime the send window opens next, `now` if it is already open"""
+        self.ensure_one()
+        now = now or fields.Datetime.now()
+        if self._is_in_send_window(now):
+            return now
+        tz = pytz.timezone(self.send_window_tz or 'UTC')
+        local = pytz.utc.localize(now).astimezone(tz).replace(tzinfo=None)
+        hours, minutes = divmod(round(self.send_window_start * 60), 60)
+        opens = datetime.combine(local.date(), dt_time(hours % 24, minutes))
+        if opens <= local:
+            opens += timedelta(days=1)
+        return tz.localize(opens).astimezone(pytz.utc).replace(tzinfo=None)
+
+    def _format_local(self, value):
+        return format_datetime(self.env, value, dt_format='short')
+
+    def _pause_dispatch(self):
+        """Pause sending until the send window opens again, and wake the dispatcher then"""
+        for campaign in self:
+            opens = campaign._next_send_window_start()
+            campaign.write({'state': 'paused'})
+            campaign.message_post(body=_("Outside the send hours, sending resumes at %s") % campaign._format_local(opens))
+            campaign._trigger_dispatch(at=opens)
+
+    @api.model
+    def _start_due_campaigns(self):
+        """Start the scheduled campaigns that are due and resume paused ones whose send window opened
         
-        # Update state
-        # self.write({'state': 'sending', 'sent_count': 0, 'failed_count': 0})
+        Scheduled campaigns freeze their audience when they start, not when
+        they are scheduled, so they reach the recipients of the send date.
+        """
+        now = fields.Datetime.now()
+        for campaign in self.search([('state', '=', 'scheduled'), ('scheduled_at', '<=', now)]):
+            try:
+                campaign._queue_recipients()
+            except UserError as e:
+                campaign.write({'state': 'draft'})
+                campaign.message_post(body=_("Scheduled campaign not sent: %s") % e.args[0])
+                self.env.cr.commit()
+                continue
+            if campaign._is_in_send_window(now):
+                campaign.write({'state': 'sending'})
+                campaign.message_post(body=_("Scheduled campaign started"))
+            else:
+                campaign._pause_dispatch()
+            self.env.cr.commit()
         
-        # Send to first recipient to check authentication
-        first_result = self._send_to_recipient_via_api(
-            recipients[0]['phone'],
-            recipients[0]['name'],
-            self.body,
-            self.attachment_ids
+        for campaign in self.search([('state', '=', 'paused')]):
+            if campaign._is_in_send_window(now):
+                campaign.write({'state': 'sending'})
+                campaign.message_post(body=_("Send hours started, sending resumed"))
+                self.env.cr.commit()
+
+    def _get_sender_connections(self):
+        """Connections sending this campaign: the main one, plus the pool in pool mode"""
+        self.ensure_one()
+        if self.sender_mode == 'pool':
+            return self.from_connection_id | self.sender_connection_ids
+        return self.from_connection_id
+
+    def _distribute_recipients(self, count=None):
+        """Yield the sender connection of each of `count` recipients (endlessly if count is None)
+        
+        Uses a smooth weighted round robin, so connections are interleaved
+        instead of being assigned consecutive blocks of recipients.
+        """
+        self.ensure_one()
+        connections = self._get_sender_connections()
+        if self.sender_distribution == 'weighted':
+            weights = [max(connection.rate_limit_per_minute, 0.01) for connection in connections]
+        else:
+            weights = [1.0] * len(connections)
+        total_weight = sum(weights)
+        current = [0.0] * len(connections)
+        
+        for _index in (range(count) if count is not None else itertools.count()):
+            for position, weight in enumerate(weights):
+                current[position] += weight
+            best = max(range(len(connections)), key=current.__getitem__)
+            current[best] -= total_weight
+            yield connections[best]
+
+    def _snapshot_recipients(self):
+        """Freeze the audience: replace the campaign queue with one queued trace per recipient
+        
+        The recipients are streamed in chunks and each chunk is written in
+        bulk with the normalized phone, the name and the source record.
+        Numbers appearing on several records are queued once. From then on
+        the dispatcher, counters and reports read the traces, so later edits
+        to the lists or the domain do not change the audience of a started
+        campaign.
+        
+        Returns:
+            int: number of queued recipients
+        """
+        self.ensure_one()
+        Trace = self.env['whatsapp.campaign.trace']
+        self.env.cr.execute("DELETE FROM whatsapp_campaign_trace WHERE campaign_id = %s", [self.id])
+        
+        normalize = self.env['whatsapp.mailing.contact']._normalize_phone
+        senders = self._distribute_recipients()
+        uid, now = self.env.uid, fields.Datetime.now()
+        res_model = self.mailing_model_real
+        for rows in self._iter_recipient_chunks():
+            execute_values(self.env.cr._obj, """
+                INSERT INTO whatsapp_campaign_trace
+                    (campaign_id, connection_id, phone, contact_name, res_model, res_id, state,
+                     create_uid, create_date, write_uid, write_date)
+                VALUES %s
+                ON CONFLICT (campaign_id, phone) DO NOTHING
+            """, [
+                (self.id, next(senders).id, normalize(phone), name, res_model, res_id, 'queued',
+                 uid, now, uid, now)
+                for res_id, name, phone in rows
+            ], page_size=1000)
+            # Nothing read for a chunk is needed by the next one
+            self.env.invalidate_all()
+        
+        Trace.invalidate_model()
+        self.invalidate_recordset(['trace_ids'])
+        return Trace.search_count([('campaign_id', '=', self.id)])
+
+    def _send_trace(self, trace, media=None, body=None, deadline=None):
+        """Send one queued trace and record its outcome - returns the API result dict"""
+        self.ensure_one()
+        result = self._send_to_recipient_via_api(
+            trace.phone,
+            trace.contact_name,
+            self.body if body is None else body,
+            self.attachment_ids,
+            connection=trace.connection_id,
+            media=media,
+            deadline=deadline
         )
+        self._record_trace_result(trace, result)
+        return result
+
+    def _record_trace_result(self, trace, result):
+        """Write the outcome of a send on its trace"""
+        if result.get('success'):
+            trace.write({
+                'state': 'sent',
+                'message_id': result.get('message_id'),
+                'sent_at': fields.Datetime.now(),
+                'error': False,
+            })
+        elif result.get('qr_popup_needed'):
+            # QR needed keeps the trace queued so it is sent after re-authentication
+            trace.write({'state': 'queued'})
+        elif trace._is_transient_failure(result):
+            # Timeout, throttling or server error: retried later without blocking the queue
+            trace._schedule_retry(result.get('error', 'Unknown error'))
+        else:
+            trace.write({
+                'state': 'failed',
+                'failed_at': fields.Datetime.now(),
+                'error': result.get('error', 'Unknown error'),
+            })
+        return result
+
+    def _trigger_dispatch(self, at=None):
+        """Schedule a run of the campaign dispatcher cron"""
+        self.env.ref('whatsapp_chat_module.ir_cron_whatsapp_campaign_dispatch')._trigger(at=at)
+
+    @api.model
+    def _cron_dispatch(self):
+        """Send queued campaign messages within a bounded time budget
         
-        # If QR popup needed, return it
-        if first_result.get('qr_popup_needed'):
-            return {
-                'type': 'ir.actions.act_window',
-                'name': 'WhatsApp Authentication Required',
-                'res_model': 'whatsapp.qr.popup',
-                'res_id': first_result.get('qr_popup_id'),
-                'view_mode': 'form',
-                'view_id': self.env.ref('whatsapp_chat_module.whatsapp_qr_popup_view').id,
-                'target': 'new',
-            }
+        Every run interleaves all sending campaigns and, within a campaign,
+        all of its sender connections, so each connection drains its own
+        queue at its own pace. Each message is committed on its own so an
+        interrupted run (time limit, worker restart) resumes from the first
+        message still queued.
+        
+        Scheduled campaigns are started when due, and campaigns with send
+        hours are paused when their window closes and resumed when it opens.
+        """
+        deadline = time.monotonic() + cron_time_budget(DISPATCH_TIME_BUDGET)
+        self.env['whatsapp.campaign.trace']._recover_interrupted()
+        self._start_due_campaigns()
+        campaigns = self.search([('state', '=', 'sending')])
+        runs = {campaign.id: campaign._prepare_dispatch_run(deadline) for campaign in campaigns}
+        next_wait = 0.0
         
-        # If first message sent successfully, send to all remaining recipients
-        if first_result.get('success'):
-            self.sent_count = 1
+        while campaigns:
+            closed = campaigns.filtered(lambda c: not c._is_in_send_window())
+            if closed:
+                # Send hours ended during the run: report what was sent and wait for the next window
+                closed._pause_dispatch()
+                for campaign in closed:
+                    campaign._notify_progress(runs[campaign.id], force=True)
+                self.env.cr.commit()
+                campaigns -= closed
+                if not campaigns:
+                    break
             
-            # Send to remaining recipients
-            remaining_recipients = recipients[1:]
-            total_remaining = len(remaining_recipients)
+            waits = []
+            for campaign in campaigns:
+                wait = campaign._dispatch_round(runs[campaign.id])
+                if wait is not None:
+                    waits.append(wait)
+            campaigns = campaigns.filtered(lambda c: c.state == 'sending')
+            if not campaigns:
+                break
             
-            for index, recipient in enumerate(remaining_recipients):
-                result = self._send_to_recipient_via_api(
-                    recipient['phone'],
-                    recipient['name'],
-                    self.body,
-                    self.attachment_ids
-                )
-                
+            # Sleep only when no connection has a token left
+            next_wait = min(waits) if waits else 0.0
+            if time.monotonic() + next_wait >= deadline:
+                break
+            if next_wait:
+                _logger.info(f"⏳ [Campaign] Rate limit reached on all connections, waiting {next_wait:.2f}s...")
+                time.sleep(next_wait)
+        
+        for campaign in campaigns:
+            campaign._notify_progress(runs[campaign.id], force=True)
+            self.env.cr.commit()
+        if campaigns:
+            self._trigger_dispatch(at=fields.Datetime.now() + timedelta(seconds=next_wait))
+
+    def _prepare_dispatch_run(self, deadline=None):
+        """State shared by the dispatch rounds of one cron run of the campaign
+        
+        Attachments are decoded once per run and shared by every recipient.
+        Outcomes are added to the campaign counters and statistics in the same
+        transaction as the trace states, and reported on the bus in batches.
+        Counters are recounted from the traces only where they can drift:
+        when queueing, requeueing, recovering interrupted messages and
+        finishing the campaign.
+        
+        Args:
+            deadline: time.monotonic() value after which no new request is started
+        """
+        self.ensure_one()
+        now = time.monotonic()
+        return {
+            'media': self._prepare_media(self.attachment_ids),
+            'started': now,
+            'processed': 0,
+            'unreported': 0,
+            'unflushed_sent': 0,
+            'unflushed_failed': 0,
+            'reported_at': now,
+            'deadline': deadline,
+        }
+
+    def _dispatch_round(self, run=None):
+        """Send the queued traces each sender connection has tokens for
+        
+        All traces a connection may send now are claimed together and posted
+        in one bulk request to the Node service when possible.
+        
+        Args:
+            run: Dispatch run state from _prepare_dispatch_run
+        
+        Returns:
+            float: 0.0 if a message was sent, otherwise seconds until a connection
+                   has a token again or a retry is due, or None once the campaign
+                   stopped dispatching
+        """
+        self.ensure_one()
+        run = run or self._prepare_dispatch_run()
+        Trace = self.env['whatsapp.campaign.trace']
+        pending_domain = [('campaign_id', '=', self.id), ('state', '=', 'queued')]
+        queue_domain = pending_domain + ['|', ('next_attempt_at', '=', False), ('next_attempt_at', '<=', fields.Datetime.now())]
+        
+        lanes = Trace._read_group(queue_domain, ['connection_id'])
+        if not lanes:
+            next_retry = Trace.search(pending_domain, order='next_attempt_at', limit=1)
+            if next_retry:
+                # Only retries waiting for their backoff are left
+                return max((next_retry.next_attempt_at - fields.Datetime.now()).total_seconds(), 1.0)
+            in_flight = Trace.search([('campaign_id', '=', self.id), ('state', '=', 'sending')], order='write_date', limit=1)
+            if in_flight:
+                # Another worker is still sending messages of the campaign: the last one to finish closes it,
+                # look again at the latest once they would be recovered as interrupted
+                recovered_at = in_flight.write_date + timedelta(minutes=INTERRUPTED_AFTER_MINUTES)
+                return max((recovered_at - fields.Datetime.now()).total_seconds(), 1.0)
+            self._flush_counters(run)
+            self._finish_dispatch()
+            self._notify_progress(run, force=True)
+            self.env.cr.commit()
+            return None
+        
+        waits = []
+        for (connection,) in lanes:
+            if run['deadline'] and time.monotonic() >= run['deadline']:
+                # Out of time: the remaining connections are sent by the next cron run
+                waits.append(0.0)
+                break
+            sender = connection or self.from_connection_id
+            
+            # Pace sends through the connection's shared token bucket
+            granted, wait = sender._acquire_send_tokens(BULK_SEND_MAX)
+            if not granted:
+                waits.append(wait)
+                continue
+            
+            # Mark the traces in flight first: a crash during the request must not resend them
+            traces = Trace._claim_queued(self, connection, granted)
+            # Another worker claimed part of the queue first: its tokens go back to the bucket
+            sender._release_send_tokens(granted - len(traces))
+            if not traces:
+                waits.append(0.0)
+                continue
+            
+            run['processed'] += len(traces)
+            run['unreported'] += len(traces)
+            trace_bodies = {}
+            if self._is_personalized():
+                # Render just the claimed recipients, in one call rather than one per message
+                bodies, render_errors = self._render_bodies(traces.mapped('res_id'))
+                for trace in traces.filtered('res_id'):
+                    trace_bodies[trace] = bodies[trace.res_id]
+                unrendered = traces.filtered(lambda t: t in trace_bodies and not trace_bodies[t].strip())
+                if unrendered:
+                    self._fail_unrendered(unrendered, render_errors)
+                    run['unflushed_failed'] += len(unrendered)
+                    sender._release_send_tokens(len(unrendered))
+                    traces -= unrendered
+            
+            results = self._send_traces(traces, sender, run, trace_bodies) if traces else []
+            # Traces queued back at the deadline were not processed
+            run['processed'] -= len(traces) - len(results)
+            run['unreported'] -= len(traces) - len(results)
+            if results:
+                # One feedback per request: the worst answer of the batch drives the pacing
+                sender._record_send_feedback(max(results, key=self._feedback_severity))
+            if any(result.get('qr_popup_needed') for result in results):
+                # Session lost: stop until the user re-authenticates and resends
+                self._flush_counters(run)
+                self.write({'state': 'draft'})
+                self.message_post(body=_(
+                    "WhatsApp authentication is required for %s. Scan the QR code and send the campaign again to resume."
+                ) % sender.name)
+                self.env.cr.commit()
+                return None
+            for trace, result in zip(traces, results):
                 if result.get('success'):
-                    self.sent_count += 1
+                    run['unflushed_sent'] += 1
+                elif trace.state in ('failed', 'dead'):
+                    run['unflushed_failed'] += 1
+            # Counters are committed with the trace states, an interrupted run leaves them consistent
+            self._flush_counters(run)
+            self.env.cr.commit()
+            waits.append(0.0)
+        
+        if self._notify_progress(run):
+            self.env.cr.commit()
+        return min(waits)
+
+    def _send_traces(self, traces, sender, run, trace_bodies):
+        """Send claimed traces of one sender, in one bulk request when possible
+        
+        Falls back to one request per trace for a single trace, for
+        attachments that could not be uploaded, or when the Node service has
+        no bulk endpoint (remembered for the rest of the run). That fallback
+        stops at the run's deadline and queues the traces it did not send.
+        
+        Returns:
+            list: send result dicts in the order of traces, shorter than traces
+                  when the deadline stopped the fallback
+        """
+        self.ensure_one()
+        media = run['media']
+        media_ids = self._get_uploaded_media_ids(sender, media, run['deadline'])
+        bulk = len(traces) > 1 and not run.get('bulk_unsupported') and (media['message_type'] == 'chat' or media_ids)
+        
+        if bulk:
+            messages = []
+            for trace in traces:
+                message = {
+                    'to': trace.phone,
+                    'messageType': media['message_type'],
+                    'body': html_to_whatsapp_text(trace_bodies.get(trace, self.body)),
+                }
+                if media_ids:
+                    message['mediaIds'] = media_ids
+                if media['message_type'] == 'document' and media['file_type']:
+                    message['fileType'] = media['file_type']
+                messages.append(message)
+            try:
+                results = node_client.send_bulk(
+                    self._get_send_headers(sender), messages, timeout=cron_request_timeout(120, run['deadline'])
+                )
+            except node_client.BulkSendUnsupported:
+                _logger.info("[Campaign] The WhatsApp service has no bulk endpoint, sending one message per request")
+                run['bulk_unsupported'] = True
+            else:
+                for trace, result in zip(traces, results):
+                    self._record_trace_result(trace, result)
+                return results
+        
+        results = []
+        for trace in traces:
+            if run['deadline'] and time.monotonic() >= run['deadline']:
+                # Out of time: the traces not sent yet go back to the queue for the next run
+                unsent = traces[len(results):]
+                unsent.write({'state': 'queued'})
+                sender._release_send_tokens(len(unsent))
+                break
+            results.append(self._send_trace(trace, media=media, body=trace_bodies.get(trace), deadline=run['deadline']))
+        return results
+
+    @staticmethod
+    def _feedback_severity(result):
+        """Order send results from the best to the worst answer for the pacing feedback"""
+        status = result.get('status_code')
+        if status is None:
+            return 3 if result.get('transport_error') else 0
+        if status == 429 or status >= 500:
+            return 2
+        return 1 if status >= 300 else 0
+
+    def _get_send_headers(self, connection):
+        """Headers authenticating a request to the Node service for a connection"""
+        return {
+            'x-api-key': connection.api_key,
+            'x-phone-number': connection.from_field,
+            'origin': self._get_origin(),
+        }
+
+    def _get_uploaded_media_ids(self, connection, media, deadline=None):
+        """Media ids of the prepared attachments for a connection, uploaded once per run
+        
+        Args:
+            deadline: time.monotonic() value at which the dispatcher run's budget ends
+        
+        Returns:
+            list: media ids, or None when there is nothing to upload or the upload failed
+        """
+        if media['message_type'] == 'chat':
+            return None
+        uploaded = media.setdefault('media_ids', {})
+        if connection.id not in uploaded:
+            uploaded[connection.id] = self.env['whatsapp.media.upload']._get_media_ids(
+                connection, media['files'], media['message_type'], deadline=deadline
+            )
+        return uploaded[connection.id]
+
+    def _flush_counters(self, run):
+        """Add the outcomes counted in the run to the campaign counters"""
+        self.ensure_one()
+        self._increment_counters(sent=run['unflushed_sent'], failed=run['unflushed_failed'])
+        run['unflushed_sent'] = run['unflushed_failed'] = 0
+
+    def _notify_progress(self, run, force=False):
+        """Push sent/failed counts, throughput and ETA to the campaign owner over the bus
+        
+        Messages are counted in the run and reported every PROGRESS_NOTIFY_EVERY
+        messages or PROGRESS_NOTIFY_SECONDS seconds, so counters are read once
+        per batch rather than once per message.
+        
+        Returns:
+            bool: True if a notification was sent
+        """
+        self.ensure_one()
+        now = time.monotonic()
+        if not force and run['unreported'] < PROGRESS_NOTIFY_EVERY and now - run['reported_at'] < PROGRESS_NOTIFY_SECONDS:
+            return False
+        if not force and not run['unreported']:
+            return False
+        
+        self._flush_counters(run)
+        self.invalidate_recordset(['queued_count'])
+        per_minute = run['processed'] * 60.0 / max(now - run['started'], 1.0)
+        eta_seconds = int(self.queued_count * 60.0 / per_minute) if per_minute and self.queued_count else None
+        self.env['bus.bus']._sendone(self.create_uid.partner_id, 'whatsapp_campaign_progress', {
+            'campaign_id': self.id,
+            'name': self.name,
+            'state': self.state,
+            'total': self.total_recipients,
+            'sent': self.sent_count,
+            'failed': self.failed_count,
+            'queued': self.queued_count,
+            'per_minute': round(per_minute, 1),
+            'eta_seconds': eta_seconds,
+        })
+        run['unreported'] = 0
+        run['reported_at'] = now
+        return True
+
+    @api.model
+    def _can_edit_dynamic_body(self):
+        """Whether the current user may write placeholders, evaluated when sending, in a campaign body"""
+        return self.env.su or self.env.is_admin() or self.env.user.has_group('mail.group_mail_template_editor')
+
+    def _is_personalized(self):
+        """Whether the body holds placeholders to render for each recipient"""
+        self.ensure_one()
+        return bool(self.body) and '{{' in self.body and bool(self.mailing_model_real)
+
+    def _render_bodies(self, res_ids):
+        """Render the personalized body for a batch of recipient records
+        
+        A failing batch is rendered again record by record, so one bad
+        placeholder value or deleted record only fails its own recipient.
+        
+        Args:
+            res_ids: ids of records of the recipients model
+        
+        Returns:
+            tuple: (rendered body by record id, empty for records that failed,
+                    error message by record id)
+        """
+        self.ensure_one()
+        res_ids = [res_id for res_id in dict.fromkeys(res_ids) if res_id]
+        if not res_ids:
+            return {}, {}
+        # Render with the rights of the user who sent the campaign, not those of the cron
+        renderer = self.env['whatsapp.template'].with_user(self.dispatch_user_id or self.create_uid)
+        rendered, errors = {}, {}
+        try:
+            with self.env.cr.savepoint():
+                rendered = renderer._render_template(
+                    self.body, self.mailing_model_real, res_ids, engine='inline_template'
+                )
+        except Exception as e:
+            _logger.warning(f"[Campaign] Rendering {len(res_ids)} messages of campaign {self.id} failed, rendering them one by one: {e}")
+            for res_id in res_ids:
+                try:
+                    with self.env.cr.savepoint():
+                        rendered.update(renderer._render_template(
+                            self.body, self.mailing_model_real, [res_id], engine='inline_template'
+                        ))
+                except Exception as record_error:
+                    errors[res_id] = str(record_error)
+        bodies = {res_id: (res_id not in errors and rendered.get(res_id)) or '' for res_id in res_ids}
+        return bodies, errors
+
+    def _fail_unrendered(self, traces, errors=None):
+        """Fail traces whose personalized body could not be rendered rather than sending the raw placeholders
+        
+        Args:
+            traces: the traces to fail
+            errors: rendering error message by record id, for the traces whose rendering raised
+        """
+        errors = errors or {}
+        traces_by_error = {}
+        for trace in traces:
+            error = errors.get(trace.res_id)
+            if error:
+                error = _("The personalized message could not be rendered: %s") % error
+            else:
+                error = _("The personalized message could not be rendered for this recipient")
+            traces_by_error[error] = traces_by_error.get(error, traces.browse()) | trace
+        now = fields.Datetime.now()
+        for error, error_traces in traces_by_error.items():
+            error_traces.write({'state': 'failed', 'failed_at': now, 'error': error})
+
+    def _finish_dispatch(self):
+        """Mark the campaign as sent once its queue is empty
+        
+        Only the dispatcher that moves the campaign out of sending posts the
+        summary, when several workers empty the queue at the same time.
+        """
+        self.ensure_one()
+        self._recount_counters()
+        self.env.cr.execute(
+            "UPDATE whatsapp_marketing_campaign SET state = 'sent' WHERE id = %s AND state = 'sending' RETURNING id",
+            [self.id]
+        )
+        finished = bool(self.env.cr.fetchone())
+        self.invalidate_recordset(['state'])
+        if not finished:
+            return
+        self.message_post(body=_("Campaign sent: %s sent, %s failed") % (self.sent_count, self.failed_count))
+
+    def _prepare_media(self, attachments):
+        """Decode the campaign attachments once so every recipient reuses the same bytes
+        
+        Args:
+            attachments: ir.attachment records to send
+        
+        Returns:
+            dict: message_type, file_type and files as (filename, bytes, mimetype) tuples
+        """
+        # Determine message type and file type handling based on backend requirements
+        # Backend accepts: chat, image, video, document, audio, vcard, multi_vcard, location
+        image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif', '.svg', '.webp', '.ico', '.heic'}
+        video_extensions = {'.mp4', '.webm', '.ogv', '.avi', '.mov', '.wmv', '.mkv', '.flv', '.3gp'}
+        audio_extensions = {'.mp3', '.wav', '.ogg', '.m4a', '.aac', '.flac', '.mid', '.midi'}
+        document_extensions = {
+            '.txt', '.csv', '.html', '.css', '.js', '.json', '.xml', '.md', '.yml', '.yaml', '.pdf', 
+            '.zip', '.rar', '.7z', '.tar', '.gz', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', 
+            '.odt', '.ods', '.odp', '.odg', '.py', '.java', '.c', '.cpp', '.sh', '.php', '.rb', '.sql', 
+            '.ics', '.vcard', '.vcf', '.ttf', '.otf', '.woff', '.woff2', '.deb', '.rpm', '.apk', '.dmg', 
+            '.pkg', '.bin', '.wasm'
+        }
+        
+        message_type = 'chat'
+        file_type = None
+        
+        if attachments:
+            # Check first attachment to determine type
+            attachment = attachments[0]
+            filename = (attachment.name or 'attachment').lower()
+            
+            # Extract file extension
+            if '.' in filename:
+                file_ext = '.' + filename.rsplit('.', 1)[1]
+            else:
+                file_ext = None
+            
+            # Determine message type based on file extension
+            if file_ext in image_extensions:
+                message_type = 'image'
+            elif file_ext in video_extensions:
+                message_type = 'video'
+            elif file_ext in audio_extensions:
+                message_type = 'audio'
+            elif file_ext in document_extensions:
+                message_type = 'document'
+                # Extract fileType for documents (without the dot)
+                file_type = file_ext[1:].lower()  # Remove dot and lowercase
+            else:
+                # Try to infer from mimetype
+                mimetype = (getattr(attachment, 'mimetype', '') or '').lower()
+                if any(img in mimetype for img in ['image', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'svg']):
+                    message_type = 'image'
+                elif any(vid in mimetype for vid in ['video', 'mp4', 'webm', 'avi', 'mov']):
+                    message_type = 'video'
+                elif any(aud in mimetype for aud in ['audio', 'mp3', 'wav', 'ogg', 'm4a']):
+                    message_type = 'audio'
                 else:
-                    self.failed_count += 1
-                
-                # Add random delay between messages (2-5 seconds) to avoid WhatsApp detection
-                # Skip delay after the last message
-                if index < total_remaining - 1:
-                    delay = random.uniform(15.0, 25.0)
-                    _logger.info(f"⏳ [Campaign {self.name}] Waiting {delay:.2f}s before next message...")
-                    time.sleep(delay)
+                    # Default to document with bin fileType
+                    message_type = 'document'
+                    file_type = 'bin'
+        
+        files = []
+        for attachment in attachments:
+            file_data = b''
             
-            self.write({'state': 'sent'})
+            try:
+                b64_value = attachment.sudo().datas or ''
+                if isinstance(b64_value, bytes):
+                    b64_value = b64_value.decode('utf-8', errors='ignore')
+                if isinstance(b64_value, str) and b64_value.startswith('data:'):
+                    b64_value = b64_value.split(',', 1)[1] if ',' in b64_value else b64_value
+                if isinstance(b64_value, str):
+                    pad = len(b64_value) % 4
+                    if pad:
+                        b64_value = b64_value + ('=' * (4 - pad))
+                    file_data = base64.b64decode(b64_value)
+            except Exception as e:
+                _logger.error(f"Error decoding attachment: {e}")
+                continue
             
-            return {
-                'type': 'ir.actions.client',
-                'tag': 'display_notification',
-                'params': {
-                    'title': _('Campaign Sent'),
-                    'message': _('Campaign sent to %s recipients (%s sent, %s failed)') % (
-                        len(recipients), self.sent_count, self.failed_count
-                    ),
-                    'type': 'success' if self.failed_count == 0 else 'warning',
-                }
-            }
-        else:
-            # First message failed
-            self.failed_count = 1
-            self.write({'state': 'draft'})
-            raise UserError(_("Failed to send: %s") % first_result.get('error', 'Unknown error'))
+            filename = (attachment.name or 'attachment').replace('/', '_').replace('\\', '_')
+            mimetype = getattr(attachment, 'mimetype', None) or 'application/octet-stream'
+            if filename.lower().endswith('.pdf'):
+                mimetype = 'application/pdf'
+            
+            if file_data and len(file_data) > 0:
+                files.append((filename, file_data, mimetype))
+        
+        return {'message_type': message_type, 'file_type': file_type, 'files': files}
 
-    def _send_to_recipient_via_api(self, phone, contact_name, body, attachments, test_wizard_id=None, test_phone_to=None):
+    def _send_to_recipient_via_api(self, phone, contact_name, body, attachments, test_wizard_id=None, test_phone_to=None, connection=None, media=None, deadline=None):
         """Send WhatsApp message via REST API - returns dict with success/qr_popup_needed
         
         Args:
@@ -453,8 +1422,12 @@ class WhatsAppMarketingCampaign(models.Model):
             attachments: Attachments to send
             test_wizard_id: Optional ID of test wizard if this is a test send
             test_phone_to: Optional test phone number to store in QR popup (for resend if wizard is closed)
+            connection: WhatsApp connection to send from (defaults to self.from_connection_id)
+            media: Attachments already prepared by _prepare_media (prepared from attachments if not given)
+            deadline: time.monotonic() value at which the dispatcher run's budget ends, caps the request timeouts
         """
         self.ensure_one()
+        connection = connection or self.from_connection_id
         
         raw_phone = phone or ''
         compact = re.sub(r'\s+', ' ', raw_phone).strip()
@@ -468,110 +1441,46 @@ class WhatsAppMarketingCampaign(models.Model):
     
         _logger.info(f"Sending to {phone}")
         try:
-            # Convert HTML body to plain text
-            if body:
-                soup = BeautifulSoup(body, 'html.parser')
-                plain_text = soup.get_text(separator=' ')
-                plain_text = re.sub(r' {3,}', ' ', plain_text)
-                plain_text = plain_text.replace('&nbsp;', ' ')
-                plain_text = plain_text.replace('&amp;', '&')
-                plain_text = plain_text.replace('&lt;', '<')
-                plain_text = plain_text.replace('&gt;', '>')
-                plain_text = plain_text.replace('&quot;', '"')
-            else:
-                plain_text = ""
+            # Convert HTML body to WhatsApp text (memoized, parsed once per body)
+            plain_text = html_to_whatsapp_text(body)
             
             # Prepare headers
-            headers = {
-                'x-api-key': self.from_connection_id.api_key,
-                'x-phone-number': self.from_connection_id.from_field,
-                'origin': self._get_origin(),
-            }
+            headers = self._get_send_headers(connection)
             
             api_url = "http://localhost:3000/api/whatsapp/send"
-            has_attachments = bool(attachments)
-            
-            # Determine message type and file type handling based on backend requirements
-            # Backend accepts: chat, image, video, document, audio, vcard, multi_vcard, location
-            image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif', '.svg', '.webp', '.ico', '.heic'}
-            video_extensions = {'.mp4', '.webm', '.ogv', '.avi', '.mov', '.wmv', '.mkv', '.flv', '.3gp'}
-            audio_extensions = {'.mp3', '.wav', '.ogg', '.m4a', '.aac', '.flac', '.mid', '.midi'}
-            document_extensions = {
-                '.txt', '.csv', '.html', '.css', '.js', '.json', '.xml', '.md', '.yml', '.yaml', '.pdf', 
-                '.zip', '.rar', '.7z', '.tar', '.gz', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', 
-                '.odt', '.ods', '.odp', '.odg', '.py', '.java', '.c', '.cpp', '.sh', '.php', '.rb', '.sql', 
-                '.ics', '.vcard', '.vcf', '.ttf', '.otf', '.woff', '.woff2', '.deb', '.rpm', '.apk', '.dmg', 
-                '.pkg', '.bin', '.wasm'
-            }
+            if media is None:
+                media = self._prepare_media(attachments)
+            message_type = media['message_type']
+            file_type = media['file_type']
             
-            message_type = 'chat'
-            file_type = None
+            response = None
+            # Upload once per connection and run, then send by media id
+            media_ids = self._get_uploaded_media_ids(connection, media, deadline)
             
-            if has_attachments:
-                # Check first attachment to determine type
-                attachment = attachments[0]
-                filename = (attachment.name or 'attachment').lower()
-                
-                # Extract file extension
-                if '.' in filename:
-                    file_ext = '.' + filename.rsplit('.', 1)[1]
-                else:
-                    file_ext = None
-                
-                # Determine message type based on file extension
-                if file_ext in image_extensions:
-                    message_type = 'image'
-                elif file_ext in video_extensions:
-                    message_type = 'video'
-                elif file_ext in audio_extensions:
-                    message_type = 'audio'
-                elif file_ext in document_extensions:
-                    message_type = 'document'
-                    # Extract fileType for documents (without the dot)
-                    file_type = file_ext[1:].lower()  # Remove dot and lowercase
-                else:
-                    # Try to infer from mimetype
-                    mimetype = (getattr(attachment, 'mimetype', '') or '').lower()
-                    if any(img in mimetype for img in ['image', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'svg']):
-                        message_type = 'image'
-                    elif any(vid in mimetype for vid in ['video', 'mp4', 'webm', 'avi', 'mov']):
-                        message_type = 'video'
-                    elif any(aud in mimetype for aud in ['audio', 'mp3', 'wav', 'ogg', 'm4a']):
-                        message_type = 'audio'
-                    else:
-                        # Default to document with bin fileType
-                        message_type = 'document'
-                        file_type = 'bin'
+            started = time.monotonic()
+            if media_ids:
+                payload = {
+                    'to': phone,
+                    'messageType': message_type,
+                    'body': plain_text,
+                    'mediaIds': media_ids,
+                }
+                if message_type == 'document' and file_type:
+                    payload['fileType'] = file_type
+                response = requests.post(api_url, json=payload, headers=headers, timeout=cron_request_timeout(120, deadline))
+                if response.status_code in [404, 410]:
+                    # The service dropped the media: forget it and send the files this time
+                    _logger.warning(f"[Campaign] Media {media_ids} expired on the service, falling back to file upload")
+                    self.env['whatsapp.media.upload']._forget(connection, media['files'])
+                    media['media_ids'].pop(connection.id, None)
+                    response = None
             
-            if has_attachments:
-                # Build multipart form with files
-                files = []
-                
-                for attachment in attachments:
-                    file_data = b''
-                    
-                    try:
-                        b64_value = attachment.sudo().datas or ''
-                        if isinstance(b64_value, bytes):
-                            b64_value = b64_value.decode('utf-8', errors='ignore')
-                        if isinstance(b64_value, str) and b64_value.startswith('data:'):
-                            b64_value = b64_value.split(',', 1)[1] if ',' in b64_value else b64_value
-                        if isinstance(b64_value, str):
-                            pad = len(b64_value) % 4
-                            if pad:
-                                b64_value = b64_value + ('=' * (4 - pad))
-                            file_data = base64.b64decode(b64_value)
-                    except Exception as e:
-                        _logger.error(f"Error decoding attachment: {e}")
-                        continue
-                    
-                    filename = (attachment.name or 'attachment').replace('/', '_').replace('\\', '_')
-                    mimetype = getattr(attachment, 'mimetype', None) or 'application/octet-stream'
-                    if filename.lower().endswith('.pdf'):
-                        mimetype = 'application/pdf'
-                    
-                    if file_data and len(file_data) > 0:
-                        files.append(('files', (filename, io.BytesIO(file_data), mimetype)))
+            if response is None and message_type != 'chat':
+                # Build multipart form from the prepared bytes, a fresh stream per request
+                files = [
+                    ('files', (filename, io.BytesIO(file_data), mimetype))
+                    for filename, file_data, mimetype in media['files']
+                ]
                 
                 form_data = {
                     'to': phone,
@@ -588,9 +1497,9 @@ class WhatsAppMarketingCampaign(models.Model):
                     data=form_data,
                     files=files,
                     headers=headers,
-                    timeout=120
+                    timeout=cron_request_timeout(120, deadline)
                 )
-            else:
+            elif response is None:
                 # Simple JSON body
                 response = requests.post(
                     api_url,
@@ -600,15 +1509,18 @@ class WhatsAppMarketingCampaign(models.Model):
                         'body': plain_text,
                     },
                     headers=headers,
-                    timeout=120
+                    timeout=cron_request_timeout(120, deadline)
                 )
             
+            # Status and latency of the service answer, fed back to the adaptive pacing
+            feedback = {'status_code': response.status_code, 'latency': time.monotonic() - started}
+            
             # Handle response
             if response.status_code in [200, 201]:
                 try:
                     response_data = response.json()
                 except Exception as json_error:
-                    return {'success': False, 'error': f'Invalid JSON: {json_error}'}
+                    return {'success': False, 'error': f'Invalid JSON: {json_error}', **feedback}
                 
                 # Check for QR code in response (201 status or qrCode in data)
                 qr_code_in_response = response_data.get('qrCode') or (
@@ -626,11 +1538,11 @@ class WhatsAppMarketingCampaign(models.Model):
                     qr_popup_vals = {
                         'qr_code_image': qr_code_base64,
                         'qr_code_filename': 'whatsapp_qr_code.png',
-                        'from_number': self.from_connection_id.from_field,
-                        'from_name': self.from_connection_id.name,
+                        'from_number': connection.from_field,
+                        'from_name': connection.name,
                         'message': response_data.get('message', 'Please scan QR code to connect WhatsApp'),
-                        'api_key': self.from_connection_id.api_key,
-                        'phone_number': self.from_connection_id.from_field,
+                        'api_key': connection.api_key,
+                        'phone_number': connection.from_field,
                         'qr_expires_at': fields.Datetime.now() + timedelta(seconds=120),
                         'countdown_seconds': 120,
                         'is_expired': False,
@@ -648,16 +1560,22 @@ class WhatsAppMarketingCampaign(models.Model):
                     return {
                         'qr_popup_needed': True,
                         'qr_popup_id': qr_popup.id,
+                        **feedback,
                     }
                 
                 # No QR needed - check success flag
                 if response_data.get('success', False):
-                    return {'success': True}
+                    response_payload = response_data.get('data') if isinstance(response_data.get('data'), dict) else {}
+                    return {
+                        'success': True,
+                        'message_id': response_data.get('messageId') or response_payload.get('messageId') or response_payload.get('id'),
+                        **feedback,
+                    }
                 else:
                     error_detail = response_data.get('error', response_data.get('message', 'Unknown error'))
                     if isinstance(error_detail, dict):
                         error_detail = error_detail.get('message', str(error_detail))
-                    return {'success': False, 'error': error_detail}
+                    return {'success': False, 'error': error_detail, **feedback}
             else:
                 # Error response
                 try:
@@ -668,69 +1586,32 @@ class WhatsAppMarketingCampaign(models.Model):
                 except:
                     error_detail = response.text[:200] if response.text else "Unknown error"
                 
-                return {'success': False, 'error': error_detail}
+                return {'success': False, 'error': error_detail, **feedback}
                 
+        except requests.exceptions.RequestException as e:
+            # Timeout or service unreachable: no status code, the pacing backs off
+            _logger.warning(f"Error sending to {contact_name}: {e}")
+            return {'success': False, 'error': str(e), 'status_code': None, 'transport_error': True}
         except Exception as e:
             _logger.exception(f"Error sending to {contact_name}: {e}")
             return {'success': False, 'error': str(e)}
 
     def action_close_qr_popup(self, popup=False):
-        """Resend campaign after QR authentication"""
+        """Resume campaign after QR authentication"""
         self.ensure_one()
         
-        # Get recipients
-        recipients = self._get_recipients()
-        if not recipients:
+        Trace = self.env['whatsapp.campaign.trace']
+        queued_count = Trace.search_count([('campaign_id', '=', self.id), ('state', '=', 'queued')])
+        if not queued_count:
             return {}
         
-        # Reset counters
-        self.write({'sent_count': 0, 'failed_count': 0, 'state': 'sending'})
-        
-        # Send to all recipients
-        total_recipients = len(recipients)
-        for index, recipient in enumerate(recipients):
-            result = self._send_to_recipient_via_api(
-                recipient['phone'],
-                recipient['name'],
-                self.body,
-                self.attachment_ids
-            )
-            
-            if result.get('success'):
-                self.sent_count += 1
-            elif result.get('qr_popup_needed'):
-                # QR needed again - return the popup
-                return {
-                    'type': 'ir.actions.act_window',
-                    'name': 'WhatsApp Authentication Required',
-                    'res_model': 'whatsapp.qr.popup',
-                    'res_id': result.get('qr_popup_id'),
-                    'view_mode': 'form',
-                    'view_id': self.env.ref('whatsapp_chat_module.whatsapp_qr_popup_view').id,
-                    'target': 'new',
-                }
-            else:
-                self.failed_count += 1
-            
-            # Add random delay between messages (2-5 seconds) to avoid WhatsApp detection
-            # Skip delay after the last message
-            if index < total_recipients - 1:
-                delay = random.uniform(15.0, 25.0)
-                _logger.info(f"⏳ [Campaign {self.name}] Waiting {delay:.2f}s before next message...")
-                time.sleep(delay)
-        
-        # Update state
-        self.write({'state': 'sent'})
-        
-        # Build message
-        if self.sent_count > 0:
-            message = self.failed_count > 0 \
-                and _("%d sent, %d failed") % (self.sent_count, self.failed_count) \
-                or _("Successfully sent %d messages!") % self.sent_count
-            notif_type = "warning" if self.failed_count > 0 else "success"
-        else:
-            message = _("Failed to send campaign")
-            notif_type = "danger"
+        # Queued messages are sent by the dispatcher cron
+        self._recount_counters()
+        self.write({'state': 'sending'})
+        self._trigger_dispatch()
+        
+        message = _("Authenticated! Sending %d messages in the background.") % queued_count
+        notif_type = "success"
         
         popup_id = popup.id if popup else (
             self.env['whatsapp.qr.popup'].search([
@@ -746,7 +1627,7 @@ class WhatsAppMarketingCampaign(models.Model):
             'message': message,
             'type': notif_type,
             'sticky': False,
-            'success': self.sent_count > 0
+            'success': True
         }
         
         dbname = self._cr.dbname
@@ -768,8 +1649,8 @@ class WhatsAppMarketingCampaign(models.Model):
         return {}
 
     def _get_origin(self):
-        """Get origin from request headers"""
-        origin = '127.0.0.1'
+        """Get origin from request headers (the stored dispatch origin outside of a request)"""
+        origin = (len(self) == 1 and self.dispatch_origin) or '127.0.0.1'
         try:
             from odoo import http
             request = http.request
@@ -802,34 +1683,8 @@ class WhatsAppMarketingCampaign(models.Model):
         # Get origin from request (for socket matching)
         origin = self._get_origin()
         
-        # Trigger socket connection
-        connection._trigger_socket_connection(origin)
-        
-        # Clear and wait for confirmation
-        connection.socket_connection_ready = False
-        connection.env.cr.commit()
-        
-        # Wait for socket connection
-        check_interval = 0.1
-        waited = 0
-        
-        socket_confirmed = False
-        while waited < max_wait:
-            fresh_env = connection.env(cr=connection.env.cr)
-            fresh_record = fresh_env['whatsapp.connection'].browse(connection.id)
-            fresh_record.invalidate_recordset(['socket_connection_ready'])
-            
-            if fresh_record.socket_connection_ready:
-                socket_confirmed = True
-                _logger.info(f"[{context_name}] Socket confirmed connected after {waited:.1f}s")
-                break
-            time.sleep(check_interval)
-            waited += check_interval
-        
-        if not socket_confirmed:
-            _logger.warning(f"[{context_name}] Socket not confirmed within {max_wait}s, proceeding anyway")
-        
-        return socket_confirmed
+        # Trigger socket connection and wait for the frontend to confirm it
+        return connection._wait_socket_ready(origin, max_wait=max_wait, context_name=context_name)
 
 
 class WhatsAppMarketingCampaignTest(models.TransientModel):
@@ -881,6 +1736,7 @@ class WhatsAppMarketingCampaignTest(models.TransientModel):
         )
         
         # Send test message
+        self.campaign_id.from_connection_id._wait_send_token(context_name="Test")
         result = self.campaign_id._send_to_recipient_via_api(
             self.phone_to.strip(),
             'Test Recipient',
@@ -934,6 +1790,7 @@ class WhatsAppMarketingCampaignTest(models.TransientModel):
         )
         
         # Send test message again
+        self.campaign_id.from_connection_id._wait_send_token(context_name="Test Resend")
         result = self.campaign_id._send_to_recipient_via_api(
             self.phone_to.strip(),
             'Test Recipient',
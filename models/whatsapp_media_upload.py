@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields, api
+from ..tools.cron import cron_request_timeout
+from datetime import timedelta
+import hashlib
+import io
+import logging
+import requests
+
+_logger = logging.getLogger(__name__)
+
+# Uploaded media is kept by the WhatsApp provider for 30 days, re-upload a day before
+MEDIA_LIFETIME_DAYS = 29
+
+UPLOAD_MEDIA_URL = "http://localhost:3000/api/whatsapp/upload-media"
+
+
+class WhatsAppMediaUpload(models.Model):
+    """Media already uploaded to the WhatsApp service, one row per sender and file content"""
+    _name = 'whatsapp.media.upload'
+    _description = 'WhatsApp Uploaded Media'
+    _order = 'id desc'
+    _rec_name = 'filename'
+
+    connection_id = fields.Many2one(
+        'whatsapp.connection',
+        string='Connection',
+        required=True,
+        index=True,
+        ondelete='cascade'
+    )
+    checksum = fields.Char('Checksum', required=True, readonly=True, help="SHA1 of the uploaded file content")
+    filename = fields.Char('File Name', readonly=True)
+    mimetype = fields.Char('Mime Type', readonly=True)
+    media_id = fields.Char('Media ID', required=True, readonly=True, help="Media handle returned by the WhatsApp service")
+    expires_at = fields.Datetime('Expires At', required=True, readonly=True, index=True)
+
+    _sql_constraints = [
+        ('connection_checksum_unique', 'UNIQUE(connection_id, checksum)', 'A file can only be uploaded once per connection!'),
+    ]
+
+    @api.model
+    def _checksum(self, file_data):
+        return hashlib.sha1(file_data).hexdigest()
+
+    @api.model
+    def _get_media_ids(self, connection, files, message_type, deadline=None):
+        """Return the media ids of files for a connection, uploading the ones not cached yet
+
+        Args:
+            connection: whatsapp.connection the files are sent from
+            files: list of (filename, bytes, mimetype) tuples
+            message_type: WhatsApp message type of the upload (image, video, audio, document)
+            deadline: time.monotonic() value at which the calling cron run's budget ends
+
+        Returns:
+            list: media ids in the order of files, or None if any upload failed
+        """
+        if not files:
+            return None
+
+        checksums = [self._checksum(file_data) for _filename, file_data, _mimetype in files]
+        cached = {
+            upload.checksum: upload.media_id
+            for upload in self.sudo().search([
+                ('connection_id', '=', connection.id),
+                ('checksum', 'in', checksums),
+                ('expires_at', '>', fields.Datetime.now()),
+            ])
+        }
+
+        media_ids = []
+        for (filename, file_data, mimetype), checksum in zip(files, checksums):
+            if checksum not in cached:
+                media_id = self._upload(
+                    connection, filename, file_data, mimetype, message_type,
+                    timeout=cron_request_timeout(120, deadline)
+                )
+                if not media_id:
+                    return None
+                self._store(connection, checksum, filename, mimetype, media_id)
+                cached[checksum] = media_id
+            media_ids.append(cached[checksum])
+        return media_ids
+
+    @api.model
+    def _upload(self, connection, filename, file_data, mimetype, message_type, timeout=120):
+        """Upload one file to the WhatsApp service - returns its media id or None"""
+        headers = {
+            'x-api-key': connection.api_key,
+            'x-phone-number': connection.from_field,
+        }
+        try:
+            response = requests.post(
+                UPLOAD_MEDIA_URL,
+                data={'type': message_type},
+                files={'file': (filename, io.BytesIO(file_data), mimetype)},
+                headers=headers,
+                timeout=timeout
+            )
+            result = response.json() if response.status_code in [200, 201] else {}
+        except Exception as e:
+            _logger.warning(f"[Media] Upload of {filename} failed: {e}")
+            return None
+
+        if not result.get('success'):
+            _logger.warning(f"[Media] Upload of {filename} rejected: {response.status_code} {response.text[:200]}")
+            return None
+
+        media_id = result.get('media_id') or result.get('mediaId') or result.get('id')
+        _logger.info(f"📎 [Media] Uploaded {filename} ({len(file_data)} bytes) as {media_id}")
+        return media_id
+
+    @api.model
+    def _store(self, connection, checksum, filename, mimetype, media_id):
+        """Remember an uploaded file, replacing an expired entry of the same content"""
+        self.env.cr.execute("""
+            INSERT INTO whatsapp_media_upload
+                (connection_id, checksum, filename, mimetype, media_id, expires_at,
+                 create_uid, create_date, write_uid, write_date)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (connection_id, checksum) DO UPDATE
+            SET media_id = EXCLUDED.media_id, expires_at = EXCLUDED.expires_at,
+                write_uid = EXCLUDED.write_uid, write_date = EXCLUDED.write_date
+        """, [
+            connection.id, checksum, filename, mimetype, media_id,
+            fields.Datetime.now() + timedelta(days=MEDIA_LIFETIME_DAYS),
+            self.env.uid, fields.Datetime.now(), self.env.uid, fields.Datetime.now(),
+        ])
+        self.invalidate_model()
+
+    @api.model
+    def _forget(self, connection, files):
+        """Drop cached media ids the service no longer accepts"""
+        checksums = [self._checksum(file_data) for _filename, file_data, _mimetype in files]
+        self.sudo().search([('connection_id', '=', connection.id), ('checksum', 'in', checksums)]).unlink()
+
+    @api.autovacuum
+    def _gc_expired(self):
+        self.sudo().search([('expires_at', '<', fields.Datetime.now())]).unlink()
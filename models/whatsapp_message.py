@@ -260,12 +260,3 @@ class WhatsAppMessage(models.Model):
         except Exception as e:
             _logger.error(f"Error processing webhook message: {str(e)}")
             return False
-
-    def action_resend_message(self):
-        """Resend failed message"""
-        if self.status == 'failed':
-            # Update status to pending
-            self.write({'status': 'pending'})
-            # Trigger resend logic here
-            return True
-        return False
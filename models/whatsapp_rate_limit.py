@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models, fields
+import logging
+import random
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Adaptive pacing: multiplicative speed up on fast successes, exponential back off on throttling
+ADAPTIVE_SPEEDUP = 1.1
+ADAPTIVE_SLOWDOWN = 0.8
+ADAPTIVE_BACKOFF = 0.5
+ADAPTIVE_MIN_PER_MINUTE = 0.5
+# Seconds under which an answer counts as fast, plus the extra seconds allowed per additional message of a bulk request
+ADAPTIVE_FAST_LATENCY = 2.0
+ADAPTIVE_BULK_LATENCY_PER_MESSAGE = 0.2
+# An answer this many times slower than the average counts as rising latency
+ADAPTIVE_SLOW_FACTOR = 2.0
+
+
+class WhatsAppRateLimitBucket(models.Model):
+    """Token bucket state shared by all Odoo workers, one row per sender"""
+    _name = 'whatsapp.rate.limit.bucket'
+    _description = 'WhatsApp Rate Limit Bucket'
+    _log_access = False
+    _rec_name = 'key'
+
+    key = fields.Char('Sender Key', required=True, readonly=True, help="'<model>,<id>' of the rate limited sender")
+    tokens = fields.Float('Available Tokens', readonly=True)
+    stamp = fields.Float('Last Refill', readonly=True, help="Epoch seconds of the last refill")
+    rate = fields.Float('Current Rate', readonly=True, help="Messages per minute currently allowed by the adaptive pacing")
+    latency = fields.Float('Average Latency', readonly=True, help="Moving average of the send latency in seconds")
+
+    _sql_constraints = [
+        ('key_unique', 'UNIQUE(key)', 'Only one rate limit bucket per sender is allowed!'),
+    ]
+
+
+class WhatsAppRateLimitMixin(models.AbstractModel):
+    """Per-sender token bucket pacing outbound messages across workers
+
+    Tokens refill at rate_limit_per_minute up to rate_limit_burst; every
+    outbound message takes one token. The bucket state lives in
+    whatsapp.rate.limit.bucket and is updated in its own short transaction,
+    so concurrent senders (campaign cron, compose wizard, API service) share
+    the same budget without holding locks for the whole send.
+    """
+    _name = 'whatsapp.rate.limit.mixin'
+    _description = 'WhatsApp Rate Limit Mixin'
+
+    rate_limit_burst = fields.Integer(
+        'Burst',
+        default=3,
+        help="Messages that can be sent back to back before pacing applies"
+    )
+    rate_limit_per_minute = fields.Float(
+        'Messages per Minute',
+        default=3.0,
+        help="Sustained sending rate once the burst is used up"
+    )
+    rate_limit_jitter = fields.Float(
+        'Jitter (seconds)',
+        default=5.0,
+        help="Random extra delay added to each wait to avoid a regular sending pattern"
+    )
+    rate_limit_adaptive = fields.Boolean(
+        'Adaptive Rate',
+        default=True,
+        help="Speed up while the WhatsApp service answers quickly and back off exponentially on "
+             "throttling (429), server errors, timeouts or rising latency"
+    )
+    rate_limit_max_per_minute = fields.Float(
+        'Max Messages per Minute',
+        default=10.0,
+        help="Ceiling the adaptive rate may speed up to"
+    )
+    rate_limit_current = fields.Float(
+        'Current Rate',
+        compute='_compute_rate_limit_state',
+        help="Messages per minute currently used for this sender"
+    )
+    rate_limit_latency = fields.Float(
+        'Average Latency (s)',
+        compute='_compute_rate_limit_state',
+        help="Moving average of the time the WhatsApp service takes to accept a message"
+    )
+
+    def _compute_rate_limit_state(self):
+        buckets = {
+            bucket.key: bucket
+            for bucket in self.env['whatsapp.rate.limit.bucket'].sudo().search([
+                ('key', 'in', [f"{self._name},{record.id}" for record in self if record.id]),
+            ])
+        }
+        for record in self:
+            bucket = buckets.get(f"{record._name},{record.id}")
+            record.rate_limit_current = (bucket.rate if bucket and record.rate_limit_adaptive else 0.0) or record.rate_limit_per_minute
+            record.rate_limit_latency = bucket.latency if bucket else 0.0
+
+    def _rate_limit_key(self):
+        self.ensure_one()
+        return f"{self._name},{self.id}"
+
+    def _acquire_send_token(self):
+        """Take one token from the sender's bucket without blocking
+
+        Returns:
+            float: 0.0 if a token was taken, otherwise seconds to wait before retrying
+        """
+        granted, wait = self._acquire_send_tokens(1)
+        return 0.0 if granted else wait
+
+    def _acquire_send_tokens(self, max_count):
+        """Take up to max_count tokens from the sender's bucket without blocking
+
+        Returns:
+            tuple: (number of tokens taken, seconds to wait before retrying if none was taken)
+        """
+        self.ensure_one()
+        burst = max(self.rate_limit_burst, 1)
+        key = self._rate_limit_key()
+
+        with self.pool.cursor() as cr:
+            cr.execute("""
+                INSERT INTO whatsapp_rate_limit_bucket (key, tokens, stamp, rate)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (key) DO NOTHING
+            """, [key, burst, time.time(), self.rate_limit_per_minute])
+            cr.execute("""
+                SELECT tokens, stamp, rate FROM whatsapp_rate_limit_bucket
+                WHERE key = %s FOR UPDATE
+            """, [key])
+            tokens, stamp, adaptive_rate = cr.fetchone()
+
+            per_minute = (adaptive_rate if self.rate_limit_adaptive else 0.0) or self.rate_limit_per_minute
+            rate = max(per_minute, 0.01) / 60.0
+
+            now = time.time()
+            tokens = min(burst, (tokens or 0.0) + max(now - (stamp or now), 0.0) * rate)
+            granted = min(int(tokens), max_count) if tokens >= 1.0 else 0
+            if granted:
+                tokens -= granted
+                wait = 0.0
+            else:
+                wait = (1.0 - tokens) / rate + random.uniform(0.0, max(self.rate_limit_jitter, 0.0))
+
+            cr.execute("""
+                UPDATE whatsapp_rate_limit_bucket SET tokens = %s, stamp = %s WHERE key = %s
+            """, [tokens, now, key])
+        return granted, wait
+
+    def _release_send_tokens(self, count):
+        """Give back tokens taken by _acquire_send_tokens that were not used for a send"""
+        self.ensure_one()
+        if count <= 0:
+            return
+        with self.pool.cursor() as cr:
+            cr.execute("""
+                UPDATE whatsapp_rate_limit_bucket SET tokens = LEAST(tokens + %s, %s) WHERE key = %s
+            """, [count, max(self.rate_limit_burst, 1), self._rate_limit_key()])
+
+    def _record_send_feedback(self, result):
+        """Adapt the sender's rate to how the WhatsApp service answered a send
+
+        Bulk requests are judged on their whole request time against a
+        threshold growing with their batch_size, and only single sends feed
+        the average latency, so a slow bulk request is never mistaken for a
+        fast single send.
+
+        Args:
+            result: send result dict with status_code (None on timeout or
+                    connection error), latency of the request in seconds and
+                    batch_size, the messages posted by the request (1 if absent)
+        """
+        self.ensure_one()
+        if not self.rate_limit_adaptive or 'status_code' not in result:
+            return
+        status = result.get('status_code')
+        latency = result.get('latency')
+        batch_size = max(result.get('batch_size') or 1, 1)
+        fast_latency = ADAPTIVE_FAST_LATENCY + ADAPTIVE_BULK_LATENCY_PER_MESSAGE * (batch_size - 1)
+        key = self._rate_limit_key()
+        ceiling = max(self.rate_limit_max_per_minute, self.rate_limit_per_minute)
+
+        with self.pool.cursor() as cr:
+            cr.execute("""
+                SELECT tokens, stamp, rate, latency FROM whatsapp_rate_limit_bucket
+                WHERE key = %s FOR UPDATE
+            """, [key])
+            row = cr.fetchone()
+            if not row:
+                return
+            tokens, stamp, rate, average = row
+            rate = rate or self.rate_limit_per_minute
+
+            if status is None or status == 429 or status >= 500:
+                # Throttled or failing: halve the rate on every occurrence and empty the bucket
+                rate *= ADAPTIVE_BACKOFF
+                tokens, stamp = 0.0, time.time()
+                _logger.warning(f"⏳ [Rate Limit] {self.display_name} answered {status or 'no response'}, slowing down to {rate:.2f} msgs/min")
+            elif latency and batch_size > 1 and latency > fast_latency * ADAPTIVE_SLOW_FACTOR:
+                rate *= ADAPTIVE_SLOWDOWN
+            elif latency and batch_size == 1 and average and latency > average * ADAPTIVE_SLOW_FACTOR:
+                rate *= ADAPTIVE_SLOWDOWN
+            elif status < 300 and (latency is None or latency <= fast_latency):
+                rate *= ADAPTIVE_SPEEDUP
+            rate = min(max(rate, ADAPTIVE_MIN_PER_MINUTE), ceiling)
+
+            if latency is not None and status is not None and batch_size == 1:
+                average = latency if not average else average * 0.8 + latency * 0.2
+
+            cr.execute("""
+                UPDATE whatsapp_rate_limit_bucket SET tokens = %s, stamp = %s, rate = %s, latency = %s WHERE key = %s
+            """, [tokens, stamp, rate, average, key])
+
+    def _wait_send_token(self, context_name="Send"):
+        """Block until a token is available - for interactive single sends only"""
+        self.ensure_one()
+        wait = self._acquire_send_token()
+        while wait:
+            _logger.info(f"⏳ [{context_name}] Rate limit reached for {self.display_name}, waiting {wait:.2f}s...")
+            time.sleep(wait)
+            wait = self._acquire_send_token()
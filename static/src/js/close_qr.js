@@ -15,6 +15,8 @@ function setupQrPopupBus(env) {
     const dbName = session.db || env.services.user?.db?.name || 'default';
     const partnerId = env.services.user?.partnerId || null;
     const subscribedChannels = new Set();
+    const campaignProgressToasts = new Map(); // campaign id -> close function of its progress notification
+    const composeProgressToasts = new Map(); // compose job id -> close function of its progress notification
 
     // Subscribe to QR popup channel
     const subscribeToQrPopupChannel = (popupId) => {
@@ -138,7 +140,8 @@ function setupQrPopupBus(env) {
             // Format 1: Direct array of notification objects
             // Don't filter here - process all notifications and check type inside loop
             notifications = ev.detail
-                .filter(notif => notif.type === 'qr_popup_close' || notif.type === 'whatsapp_compose_close')
+                .filter(notif => notif.type === 'qr_popup_close' || notif.type === 'whatsapp_compose_close' ||
+                                 notif.type === 'whatsapp_campaign_progress' || notif.type === 'whatsapp_compose_progress')
                 .map(notif => {
                     const channel = notif.payload?.popup_id 
                         ? [dbName, `${dbName}_qr_popup_${notif.payload.popup_id}`]
@@ -233,6 +236,61 @@ function setupQrPopupBus(env) {
                 
                 return; // Exit early
             }
+            // Handle campaign progress: replace the campaign's previous progress notification
+            else if (message?.type === "whatsapp_campaign_progress") {
+                const payload = message.payload || {};
+                if (!notificationService || !payload.campaign_id) return;
+
+                const closePrevious = campaignProgressToasts.get(payload.campaign_id);
+                if (closePrevious) closePrevious();
+
+                const done = payload.state !== 'sending';
+                let text = `Sent ${payload.sent} / ${payload.total}`;
+                if (payload.failed) text += `, ${payload.failed} failed`;
+                if (payload.state === 'paused') text += ` · paused until the send hours`;
+                if (!done) {
+                    text += ` · ${payload.per_minute} msgs/min`;
+                    if (payload.eta_seconds) text += ` · ETA ${Math.ceil(payload.eta_seconds / 60)} min`;
+                }
+                const close = notificationService.add(text, {
+                    title: payload.name || "WhatsApp Campaign",
+                    type: done ? (payload.failed ? "warning" : "success") : "info",
+                    sticky: !done,
+                });
+                if (done) {
+                    campaignProgressToasts.delete(payload.campaign_id);
+                } else {
+                    campaignProgressToasts.set(payload.campaign_id, close);
+                }
+                return;
+            }
+            // Handle background compose results: one replaceable notification per job
+            else if (message?.type === "whatsapp_compose_progress") {
+                const payload = message.payload || {};
+                if (!notificationService || !payload.job_id) return;
+
+                const closePrevious = composeProgressToasts.get(payload.job_id);
+                if (closePrevious) closePrevious();
+
+                let text = `Sent ${payload.sent} / ${payload.total}`;
+                if (payload.failed) text += `, ${payload.failed} failed`;
+                if (payload.done && payload.errors?.length) {
+                    text += `: ${payload.errors.join('; ')}`;
+                } else if (!payload.done && payload.error) {
+                    text += ` · ${payload.error}`;
+                }
+                const close = notificationService.add(text, {
+                    title: payload.title || "WhatsApp",
+                    type: payload.done ? (payload.failed ? "warning" : "success") : "info",
+                    sticky: !payload.done || !!payload.failed,
+                });
+                if (payload.done) {
+                    composeProgressToasts.delete(payload.job_id);
+                } else {
+                    composeProgressToasts.set(payload.job_id, close);
+                }
+                return;
+            }
         });
     });
 }
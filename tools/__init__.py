@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+
+from .whatsapp_text import html_to_whatsapp_text
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from odoo.tools import config
+
+# Seconds left between the end of a cron run's budget and the worker's hard time limit,
+# enough for the request in flight when the budget runs out to complete
+CRON_SAFETY_MARGIN = 45
+
+# Shortest timeout of a request started just before the end of the budget
+CRON_MIN_REQUEST_TIMEOUT = 10
+
+
+def cron_time_budget(max_budget):
+    """Seconds a cron run may spend working before it must reschedule itself
+
+    Prefork workers kill a cron run after limit_time_real_cron seconds, or
+    limit_time_real when it is -1 (120 by default). The budget stays
+    CRON_SAFETY_MARGIN under that limit, keeping at least half of it for
+    short limits.
+
+    Args:
+        max_budget: longest budget, used as is when no hard limit applies
+
+    Returns:
+        float: the time budget in seconds
+    """
+    if not config.get('workers'):
+        # Threaded server: cron threads have no hard time limit
+        return max_budget
+    limit = config.get('limit_time_real_cron') or 0
+    if limit == -1:
+        limit = config.get('limit_time_real') or 0
+    if limit <= 0:
+        return max_budget
+    return min(max_budget, max(limit - CRON_SAFETY_MARGIN, limit / 2))
+
+
+def cron_request_timeout(timeout, deadline=None):
+    """Timeout of an HTTP request made during a cron run, capped to the budget left
+
+    A request started just inside the budget would otherwise run past the
+    worker's hard time limit. The timeout never drops below
+    CRON_MIN_REQUEST_TIMEOUT, which stays well within CRON_SAFETY_MARGIN.
+
+    Args:
+        timeout: timeout of the request outside of a cron run
+        deadline: time.monotonic() value at which the run's budget ends, None for no budget
+
+    Returns:
+        float: the timeout in seconds
+    """
+    if not deadline:
+        return timeout
+    return min(timeout, max(deadline - time.monotonic(), CRON_MIN_REQUEST_TIMEOUT))
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+import requests
+
+_logger = logging.getLogger(__name__)
+
+NODE_API_URL = "http://localhost:3000/api/whatsapp"
+
+# Most messages posted to the Node service in one bulk request
+BULK_SEND_MAX = 50
+
+
+# Requests in flight per connection, shared by every send of this process
+_connection_slots = {}
+_connection_slots_lock = threading.Lock()
+
+
+class BulkSendUnsupported(Exception):
+    """The Node service has no bulk send endpoint, messages must be sent one by one"""
+
+
+def send_bulk(headers, messages, timeout=120):
+    """Send several messages in one request to the Node service bulk endpoint
+
+    Contract of POST /api/whatsapp/send-bulk::
+
+        request:  {"messages": [{"ref": "1", "to": "+91 9876543210", "messageType": "chat",
+                                 "body": "...", "mediaIds": [...], "fileType": "pdf"}, ...]}
+        response: {"success": true,
+                   "results": [{"ref": "1", "success": true, "messageId": "..."},
+                               {"ref": "2", "success": false, "error": "...", "status": 400}]}
+
+    A response carrying a qrCode means the session must be authenticated
+    again and no message was sent.
+
+    Args:
+        headers: x-api-key / x-phone-number / origin headers of the sender
+        messages: list of message dicts as in the contract, without ref
+        timeout: request timeout in seconds
+
+    Returns:
+        list: one result dict per message, in the order of messages, with
+              success, message_id or error, qr_popup_needed, and the
+              status_code / latency / batch_size of the request for the adaptive pacing
+
+    Raises:
+        BulkSendUnsupported: if the service does not know the bulk endpoint
+    """
+    if not messages:
+        return []
+
+    payload = {'messages': [dict(message, ref=str(index)) for index, message in enumerate(messages)]}
+    started = time.monotonic()
+    try:
+        response = requests.post(f"{NODE_API_URL}/send-bulk", json=payload, headers=headers, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        _logger.warning(f"[Bulk Send] Request failed: {e}")
+        return [
+            {'success': False, 'error': str(e), 'status_code': None, 'transport_error': True}
+            for _message in messages
+        ]
+
+    feedback = {'status_code': response.status_code, 'latency': time.monotonic() - started, 'batch_size': len(messages)}
+    if response.status_code in (404, 405):
+        raise BulkSendUnsupported()
+
+    try:
+        response_data = response.json()
+    except ValueError:
+        response_data = {}
+
+    data = response_data.get('data') if isinstance(response_data.get('data'), dict) else {}
+    qr_code = response_data.get('qrCode') or data.get('qrCode')
+    if qr_code or response.status_code == 201:
+        return [
+            {'qr_popup_needed': True, 'qr_code': qr_code or '', 'message': response_data.get('message'), **feedback}
+            for _message in messages
+        ]
+
+    if response.status_code not in (200, 201):
+        error = response_data.get('error') or response_data.get('message') or response.text[:200] or "Unknown error"
+        if isinstance(error, dict):
+            error = error.get('message', str(error))
+        return [{'success': False, 'error': error, **feedback} for _message in messages]
+
+    by_ref = {str(result.get('ref')): result for result in response_data.get('results') or data.get('results') or []}
+    results = []
+    for index in range(len(messages)):
+        result = by_ref.get(str(index))
+        if result is None:
+            results.append({'success': False, 'error': "No result returned for this recipient", **feedback})
+        elif result.get('success'):
+            results.append({
+                'success': True,
+                'message_id': result.get('messageId') or result.get('id'),
+                **feedback,
+            })
+        else:
+            error = result.get('error') or result.get('message') or "Unknown error"
+            if isinstance(error, dict):
+                error = error.get('message', str(error))
+            results.append({'success': False, 'error': error, **feedback, 'status_code': result.get('status') or response.status_code})
+    return results
+
+
+def _slots(key, size):
+    """Semaphore bounding the requests in flight for a connection in this process"""
+    size = max(int(size or 1), 1)
+    with _connection_slots_lock:
+        slots = _connection_slots.get(key)
+        if slots is None or slots[0] != size:
+            slots = _connection_slots[key] = (size, threading.BoundedSemaphore(size))
+        return slots[1]
+
+
+def run_parallel(key, concurrency, calls):
+    """Run HTTP calls concurrently in a bounded thread pool, returning their results in order
+
+    At most `concurrency` calls of the same connection `key` run at once in
+    this process, even across sends started by different requests. The
+    calls run in worker threads, so they must not use the ORM or a cursor.
+
+    Args:
+        key: connection the calls are sent from
+        concurrency: most requests in flight for the connection
+        calls: list of callables without arguments
+
+    Returns:
+        list: the return value of each call, in the order of calls
+    """
+    if not calls:
+        return []
+    slots = _slots(key, concurrency)
+    if len(calls) == 1:
+        with slots:
+            return [calls[0]()]
+
+    def guarded(call):
+        with slots:
+            return call()
+
+    with ThreadPoolExecutor(max_workers=min(max(int(concurrency or 1), 1), len(calls))) as pool:
+        return list(pool.map(guarded, calls))
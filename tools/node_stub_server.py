@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for the Node WhatsApp service, to exercise sending offline
+
+Implements the endpoints Odoo calls when sending: /api/whatsapp/send,
+/api/whatsapp/send-bulk and /api/whatsapp/upload-media. Every message is
+accepted and logged; failures, throttling and latency can be simulated.
+
+Usage::
+
+    python3 tools/node_stub_server.py --port 3000 --latency 0.2 --fail-rate 0.05 --throttle-every 100
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import itertools
+import json
+import random
+import time
+import uuid
+
+OPTIONS = argparse.Namespace(latency=0.0, fail_rate=0.0, throttle_every=0, no_bulk=False)
+REQUESTS = itertools.count(1)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        time.sleep(OPTIONS.latency)
+
+        if OPTIONS.throttle_every and next(REQUESTS) % OPTIONS.throttle_every == 0:
+            return self._reply(429, {'success': False, 'error': 'Too many requests'})
+
+        if self.path == '/api/whatsapp/send':
+            return self._reply(200, self._send_one())
+        if self.path == '/api/whatsapp/send-bulk' and not OPTIONS.no_bulk:
+            messages = json.loads(body or b'{}').get('messages') or []
+            results = [dict(self._send_one(), ref=message.get('ref')) for message in messages]
+            print(f"bulk: {len(messages)} messages, {sum(1 for r in results if r['success'])} sent")
+            return self._reply(200, {'success': True, 'results': results})
+        if self.path == '/api/whatsapp/upload-media':
+            return self._reply(200, {'success': True, 'media_id': f"media-{uuid.uuid4().hex[:12]}"})
+        return self._reply(404, {'success': False, 'error': f"Unknown endpoint {self.path}"})
+
+    def _send_one(self):
+        if random.random() < OPTIONS.fail_rate:
+            return {'success': False, 'error': 'Simulated failure', 'status': 400}
+        return {'success': True, 'messageId': f"stub-{uuid.uuid4().hex[:16]}"}
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, fmt, *args):
+        print(f"{self.command} {self.path} {args[1] if len(args) > 1 else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every answer")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="share of messages answered as failed")
+    parser.add_argument('--throttle-every', type=int, default=0, help="answer 429 to every Nth request")
+    parser.add_argument('--no-bulk', action='store_true', help="answer 404 on send-bulk, as an older service")
+    parser.parse_args(namespace=OPTIONS)
+    server = ThreadingHTTPServer(('127.0.0.1', OPTIONS.port), StubHandler)
+    print(f"WhatsApp stub service listening on http://127.0.0.1:{OPTIONS.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+# Total bytes of report output kept in memory by each worker process
+REPORT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+class ReportCache:
+    """Least recently used cache of rendered reports, bounded by the bytes it holds
+
+    Keys must change whenever the output would, e.g. by including the
+    record's write_date, so entries never need to be invalidated and stale
+    ones simply age out.
+    """
+
+    def __init__(self, max_bytes=REPORT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached (content, format) of key and mark it recently used, or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, content, report_format):
+        """Cache the output of a report, evicting the least recently used entries beyond max_bytes"""
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[0])
+            self._entries[key] = (content, report_format)
+            self._size += len(content)
+            while self._size > self.max_bytes:
+                _key, (evicted, _format) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+report_cache = ReportCache()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+from bs4 import BeautifulSoup, Comment, Doctype, NavigableString, Tag
+from functools import lru_cache
+import re
+
+# WhatsApp inline markup for the HTML tags the editor produces
+INLINE_MARKERS = {
+    'b': '*', 'strong': '*',
+    'i': '_', 'em': '_',
+    's': '~', 'strike': '~', 'del': '~',
+    'code': '```',
+}
+BLOCK_TAGS = {'p', 'div', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'pre', 'table', 'tr'}
+
+
+def html_to_whatsapp_text(html):
+    """Convert an HTML body to WhatsApp text, keeping bold, italic, strikethrough and lists
+
+    Results are memoized on the body, so the same campaign or composer body
+    is parsed once however many recipients it is sent to.
+
+    Args:
+        html: HTML body (str), may be empty
+
+    Returns:
+        str: text with WhatsApp markup (*bold*, _italic_, ~strike~, bullets)
+    """
+    if not html:
+        return ""
+    return _convert(str(html))
+
+
+@lru_cache(maxsize=256)
+def _convert(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    text = _render_children(soup)
+    text = text.replace('\xa0', ' ')
+    text = re.sub(r'[ \t]+\n', '\n', text)
+    text = re.sub(r' {3,}', ' ', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+
+def _render_children(node):
+    return ''.join(_render(child) for child in node.children)
+
+
+def _render(node):
+    if isinstance(node, (Comment, Doctype)):
+        return ''
+    if isinstance(node, NavigableString):
+        # Plain text bodies carry their own line breaks, keep them
+        return str(node)
+    if not isinstance(node, Tag):
+        return ''
+
+    name = node.name
+    if name in ('script', 'style'):
+        return ''
+    if name == 'br':
+        return '\n'
+    if name in INLINE_MARKERS:
+        return _wrap(_render_children(node), INLINE_MARKERS[name])
+    if name in ('ul', 'ol'):
+        items = [child for child in node.children if isinstance(child, Tag) and child.name == 'li']
+        lines = []
+        for index, item in enumerate(items, start=1):
+            bullet = f"{index}." if name == 'ol' else '•'
+            lines.append(f"{bullet} {_render_children(item).strip()}")
+        return '\n' + '\n'.join(lines) + '\n'
+    if name == 'td' or name == 'th':
+        return _render_children(node).strip() + ' '
+    if name in BLOCK_TAGS:
+        content = _render_children(node).strip()
+        if name.startswith('h') and content:
+            content = _wrap(content, '*')
+        return f"\n{content}\n" if content else '\n'
+    return _render_children(node)
+
+
+def _wrap(text, marker):
+    """Put a marker around text, outside of its surrounding spaces as WhatsApp requires"""
+    stripped = text.strip()
+    if not stripped:
+        return text
+    leading = text[:len(text) - len(text.lstrip())]
+    trailing = text[len(text.rstrip()):]
+    return f"{leading}{marker}{stripped}{marker}{trailing}"
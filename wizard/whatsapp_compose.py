@@ -1,15 +1,25 @@
 # -*- coding: utf-8 -*-
 
+import functools
+import io
 import time
 import json
+import requests
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError
 from markupsafe import Markup
 import logging
 from datetime import timedelta
 from odoo import http
+from ..tools import html_to_whatsapp_text, node_client
+from ..tools.cron import cron_request_timeout
+from ..tools.node_client import BULK_SEND_MAX
+from ..tools.report_cache import report_cache
 _logger = logging.getLogger(__name__)
 
+# Hours a file rendered or uploaded in the compose wizard is kept once nothing uses it
+WIZARD_ATTACHMENT_GC_HOURS = 24
+
 class WhatsappCompose(models.TransientModel):
     _name = 'whatsapp.chat.simple.wizard'
     _description = 'WhatsApp Chat Message Composition Wizard'
@@ -25,9 +35,18 @@ class WhatsappCompose(models.TransientModel):
         'ir.attachment', 'whatsapp_chat_compose_ir_attachments_rel',
         'wizard_id', 'attachment_id', string='Attachments',
         compute='_compute_attachment_ids', readonly=False, store=True)
+    report_template_ids = fields.Many2many(
+        'ir.actions.report', 'whatsapp_chat_compose_ir_actions_report_rel',
+        'wizard_id', 'report_id', string='Reports to Attach',
+        compute='_compute_report_template_ids', readonly=False, store=True,
+        help="Template reports, rendered into attachments only when the message is sent or previewed")
     partner_ids = fields.Many2many(
         'res.partner', 'whatsapp_chat_compose_res_partner_rel',
         'wizard_id', 'partner_id', string='Recipients', required=True)
+    done_partner_ids = fields.Many2many(
+        'res.partner', 'whatsapp_chat_compose_done_partner_rel',
+        'wizard_id', 'partner_id', string='Processed Recipients',
+        help="Recipients already sent or failed, skipped when sending again after a QR scan")
     from_number = fields.Many2one(
         'whatsapp.connection', 
         string='From Number', 
@@ -191,42 +210,78 @@ class WhatsappCompose(models.TransientModel):
     @api.depends('template_id')
     def _compute_attachment_ids(self):
         for wizard in self:
-            if wizard.template_id:
-                active_model = wizard.model or wizard.env.context.get('active_model')
-                active_id = wizard.env.context.get('active_id')
-                
-                if active_model and active_id:
-                    try:
-                        # For WhatsApp templates, generate attachments like WhatsApp templates
-                        rendered_values = wizard._generate_template_for_composer(
-                            [active_id], ('attachment_ids', 'attachments'))[active_id]
-                        
-                        attachment_ids = rendered_values.get('attachment_ids') or []
-                        
-                        # Create new attachments from rendered reports (like WhatsApp templates)
-                        if rendered_values.get('attachments'):
-                            new_attachments = wizard.env['ir.attachment'].create([
-                                {'name': attach_fname,
-                                 'datas': attach_datas,
-                                 'res_model': 'whatsapp.chat.simple.wizard',
-                                 'res_id': 0,
-                                 'type': 'binary',
-                                } for attach_fname, attach_datas in rendered_values.pop('attachments')
-                            ])
-                            attachment_ids += new_attachments.ids
-                        
-                        if attachment_ids:
-                            wizard.attachment_ids = attachment_ids
-                        else:
-                            wizard.attachment_ids = False
-                    except Exception as e:
-                        # Fallback to direct attachments if rendering fails
-                        wizard.attachment_ids = wizard.template_id.attachment_ids
-                else:
-                    # Fallback to direct attachments if no record context
-                    wizard.attachment_ids = wizard.template_id.attachment_ids
-            else:
-                wizard.attachment_ids = False
+            wizard.attachment_ids = wizard.template_id.attachment_ids
+
+    @api.depends('template_id')
+    def _compute_report_template_ids(self):
+        for wizard in self:
+            wizard.report_template_ids = wizard.template_id.report_template_ids
+
+    def _render_pending_reports(self):
+        """Render the reports still waiting to be attached and move them to the attachments
+        
+        Rendered files are wizard attachments with res_id 0, removed by
+        _gc_wizard_attachments once no wizard or pending job uses them.
+        """
+        self.ensure_one()
+        active_id = self.env.context.get('active_id')
+        if not self.report_template_ids or not self.model or not active_id:
+            return
+        
+        rendered_values = self._generate_template_for_composer([active_id], ('attachments',))[active_id]
+        new_attachments = self.env['ir.attachment'].create([
+            {'name': attach_fname,
+             'datas': attach_datas,
+             'res_model': 'whatsapp.chat.simple.wizard',
+             'res_id': 0,
+             'type': 'binary',
+            } for attach_fname, attach_datas in rendered_values.get('attachments', [])
+        ])
+        self.write({
+            'attachment_ids': [(4, attachment.id) for attachment in new_attachments],
+            'report_template_ids': [(5, 0, 0)],
+        })
+
+    def action_preview_reports(self):
+        """Render the pending reports now so they can be checked before sending"""
+        self.ensure_one()
+        self._render_pending_reports()
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'whatsapp.chat.simple.wizard',
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+            'context': self.env.context,
+        }
+
+    @api.autovacuum
+    def _gc_wizard_attachments(self):
+        """Delete files rendered or uploaded in the wizard that nothing uses any more
+        
+        The chatter keeps its own copies, so only attachments still linked to
+        an open wizard or to a compose job not finished yet are kept.
+        """
+        limit = fields.Datetime.now() - timedelta(hours=WIZARD_ATTACHMENT_GC_HOURS)
+        self.env.cr.execute("""
+            SELECT att.id FROM ir_attachment att
+            WHERE att.res_model = 'whatsapp.chat.simple.wizard'
+              AND att.res_id = 0
+              AND att.create_date < %s
+              AND NOT EXISTS (
+                  SELECT 1 FROM whatsapp_chat_compose_ir_attachments_rel rel
+                  WHERE rel.attachment_id = att.id
+              )
+              AND NOT EXISTS (
+                  SELECT 1 FROM whatsapp_compose_job_ir_attachments_rel job_rel
+                  JOIN whatsapp_compose_job job ON job.id = job_rel.job_id
+                  WHERE job_rel.attachment_id = att.id AND job.state IN ('queued', 'running', 'paused')
+              )
+        """, [limit])
+        attachment_ids = [row[0] for row in self.env.cr.fetchall()]
+        if attachment_ids:
+            _logger.info(f"🧹 Removing {len(attachment_ids)} leftover WhatsApp wizard attachments")
+            self.env['ir.attachment'].sudo().browse(attachment_ids).unlink()
 
     @api.onchange('template_id')
     def _onchange_template_id(self):
@@ -315,18 +370,15 @@ class WhatsappCompose(models.TransientModel):
                 template_values[res_id]['attachment_ids'] = self.template_id.attachment_ids.ids
             
             # Generate dynamic reports (like WhatsApp templates)
-            if 'attachments' in render_fields and self.template_id.report_template_ids:
+            if 'attachments' in render_fields and self.report_template_ids:
                 try:
                     attachments = []
-                    for report in self.template_id.report_template_ids:
-                        # Generate content
-                        if report.report_type in ['qweb-html', 'qweb-pdf']:
-                            report_content, report_format = self.env['ir.actions.report']._render_qweb_pdf(report, [res_id])
-                        else:
-                            render_res = self.env['ir.actions.report']._render(report, [res_id])
-                            if not render_res:
-                                continue
-                            report_content, report_format = render_res
+                    for report in self.report_template_ids:
+                        # Generate content, reusing the output of an unchanged record
+                        render_res = self._render_report_cached(report, record)
+                        if not render_res:
+                            continue
+                        report_content, report_format = render_res
                         
                         import base64
                         report_content = base64.b64encode(report_content)
@@ -370,6 +422,37 @@ class WhatsappCompose(models.TransientModel):
         
         return template_values
 
+    def _render_report_cached(self, report, record):
+        """Render a report for one record through the process-wide report cache
+
+        Entries are keyed on the record's write_date and the language, so a
+        modified record or another language renders again.
+
+        Returns:
+            tuple: (content, format) of the report, or None if it rendered nothing
+        """
+        key = (
+            self.env.cr.dbname,
+            report.id,
+            report.write_date,
+            record.id,
+            record.write_date if 'write_date' in record._fields else None,
+            self.env.lang,
+        )
+        cached = report_cache.get(key)
+        if cached is not None:
+            _logger.info(f"📄 Report cache hit: {report.report_name} for {record._name},{record.id}")
+            return cached
+        
+        if report.report_type in ['qweb-html', 'qweb-pdf']:
+            render_res = self.env['ir.actions.report']._render_qweb_pdf(report, [record.id])
+        else:
+            render_res = self.env['ir.actions.report']._render(report, [record.id])
+        if not render_res:
+            return None
+        report_cache.set(key, *render_res)
+        return render_res
+
     @api.model
     def open_qr_popup_from_socket(self, popup_id):
         """Open QR popup from socket event using direct Odoo action"""
@@ -437,57 +520,25 @@ class WhatsappCompose(models.TransientModel):
         except:
             pass
         
-        # STEP 1: Ensure socket is connected with selected connection's credentials
-        # Trigger socket connection (same as Connect button)
-        self.from_number._trigger_socket_connection(origin)
+        # Render the template reports only now that the message is sent
+        self._render_pending_reports()
         
-        # Clear and wait for confirmation (shorter timeout than Connect button)
-        self.from_number.socket_connection_ready = False
-        self.from_number.env.cr.commit()
-        
-        # Wait for socket connection (max 2 seconds - shorter than Connect button)
-        import time
-        max_wait = 2
-        check_interval = 0.1
-        waited = 0
-        
-        socket_confirmed = False
-        while waited < max_wait:
-            fresh_env = self.from_number.env(cr=self.from_number.env.cr)
-            fresh_record = fresh_env['whatsapp.connection'].browse(self.from_number.id)
-            fresh_record.invalidate_recordset(['socket_connection_ready'])
-            
-            if fresh_record.socket_connection_ready:
-                socket_confirmed = True
-                _logger.info(f"[Wizard] Socket confirmed connected after {waited:.1f}s")
-                break
-            time.sleep(check_interval)
-            waited += check_interval
+        # STEP 1: Ensure socket is connected with selected connection's credentials
+        # (max 2 seconds - shorter than Connect button)
+        self.from_number._wait_socket_ready(origin, max_wait=2, context_name="Wizard")
         
-        if not socket_confirmed:
-            _logger.warning(f"[Wizard] Socket not confirmed within {max_wait}s, proceeding anyway")
+        # STEP 2: Several recipients are sent by a background job so the dialog closes right away
+        if len(self.partner_ids) > 1:
+            return self._send_in_background(origin)
         
-        # STEP 2: Send messages (socket should be ready for QR events)
+        # STEP 3: Send messages (socket should be ready for QR events)
         result = self._send_messages_via_socket(origin)
         
-        # Check if QR popup is needed
-        if result.get('qr_popup_needed'):
-            qr_popup_id = result.get('qr_popup_id')
-            if qr_popup_id:
-                return {
-                    'type': 'ir.actions.act_window',
-                    'name': 'WhatsApp Authentication Required',
-                    'res_model': 'whatsapp.qr.popup',
-                    'res_id': qr_popup_id,
-                    'view_mode': 'form',
-                    'view_id': self.env.ref('whatsapp_chat_module.whatsapp_qr_popup_view').id,
-                    'target': 'new',
-                    'context': {
-                        'active_model': self.env.context.get('active_model'),
-                        'active_id': self.env.context.get('active_id'),
-                        'active_ids': self.env.context.get('active_ids'),
-                    }
-                }
+        # Check if QR popup is needed, logging the messages sent before it was asked for
+        if result.get('qr_popup_needed') and result.get('qr_popup_id'):
+            if result.get('success_count', 0) > 0:
+                self._log_in_chatter([partner.name for partner in self.done_partner_ids], [])
+            return self._qr_popup_action(result['qr_popup_id'])
         
         # Log messages in chatter ONLY if messages were actually sent successfully
         if result.get('success_count', 0) > 0:
@@ -549,276 +600,462 @@ class WhatsappCompose(models.TransientModel):
         return notification
 
 
-    def _send_messages_via_socket(self, origin='127.0.0.1'):
-        """Send messages via WhatsApp API to backend"""
+    def _qr_popup_action(self, qr_popup_id):
+        return {
+            'type': 'ir.actions.act_window',
+            'name': 'WhatsApp Authentication Required',
+            'res_model': 'whatsapp.qr.popup',
+            'res_id': qr_popup_id,
+            'view_mode': 'form',
+            'view_id': self.env.ref('whatsapp_chat_module.whatsapp_qr_popup_view').id,
+            'target': 'new',
+            'context': {
+                'active_model': self.env.context.get('active_model'),
+                'active_id': self.env.context.get('active_id'),
+                'active_ids': self.env.context.get('active_ids'),
+            }
+        }
+
+    def _send_in_background(self, origin):
+        """Send the first recipient now and queue a compose job for the others
+        
+        The first message still goes out in the request, so a lost WhatsApp
+        session opens the QR popup as before. The job reports each recipient
+        over the bus and writes the chatter once when it completes.
+        """
+        self.ensure_one()
+        first = self.partner_ids.filtered('mobile')[:1] or self.partner_ids[:1]
+        result = self._send_messages_via_socket(origin, partners=first)
+        if result.get('qr_popup_needed') and result.get('qr_popup_id'):
+            return self._qr_popup_action(result['qr_popup_id'])
+        
+        self._queue_compose_job(origin, self.partner_ids - first, result)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('WhatsApp Messages Queued'),
+                'message': _("Sending to %d recipients in the background, results appear as they are sent.") % len(self.partner_ids),
+                'type': 'info',
+                'sticky': False,
+                'next': {'type': 'ir.actions.act_window_close'},
+            }
+        }
+
+    def _queue_compose_job(self, origin, partners, result=None):
+        """Create and trigger the background job sending to `partners`
+        
+        Args:
+            result: outcome of the messages already sent in the request, counted in the job
+        """
+        self.ensure_one()
+        result = result or {}
+        job = self.env['whatsapp.compose.job'].create({
+            'connection_id': self.from_number.id,
+            'partner_ids': [(6, 0, partners.ids)],
+            'total_count': len(partners) + result.get('success_count', 0) + result.get('error_count', 0),
+            'subject': self.subject,
+            'body': self.body,
+            'attachment_ids': [(6, 0, self.attachment_ids.ids)],
+            'res_model': self.model or self.env.context.get('active_model') or False,
+            'res_id': self.env.context.get('active_id') or 0,
+            'origin': origin,
+            'success_count': result.get('success_count', 0),
+            'error_count': result.get('error_count', 0),
+            'error_messages': '\n'.join(result.get('error_messages') or []),
+        })
+        job._trigger()
+        return job
+
+    def _out_of_time(self, wait=0.0):
+        """Whether a background compose job must stop rather than send or wait `wait` seconds more"""
+        deadline = self.env.context.get('compose_job_deadline')
+        return bool(deadline) and time.monotonic() + wait >= deadline
+
+    def _notify_recipient_result(self, partner, error=None):
+        """Record a recipient's outcome, and report it when sending as a background compose job"""
+        self.done_partner_ids = [(4, partner.id)]
+        job_id = self.env.context.get('compose_job_id')
+        if job_id:
+            self.env['whatsapp.compose.job'].browse(job_id)._notify_result(partner, error)
+
+    def _send_messages_bulk(self, origin, prepared_files, partners=None):
+        """Send to several partners through the Node service bulk endpoint
+        
+        Partners are sent in chunks as the connection's rate limit allows. Stops at
+        the first chunk the service cannot take in bulk (no bulk endpoint, QR
+        authentication needed), leaving those partners to the one-by-one path.
+        
+        Returns:
+            dict: partner_ids handled here, success_count and error_messages
+        """
+        done = {'partner_ids': set(), 'success_count': 0, 'error_messages': []}
+        partners = (self.partner_ids if partners is None else partners).filtered('mobile')
+        if len(partners) < 2:
+            return done
+        
+        message_type = 'document' if self.attachment_ids else 'chat'
+        deadline = self.env.context.get('compose_job_deadline')
+        media_ids = None
+        if self.attachment_ids:
+            media_ids = self.env['whatsapp.media.upload']._get_media_ids(
+                self.from_number, prepared_files, message_type, deadline=deadline
+            )
+            if not media_ids:
+                return done
+        
+        headers = {
+            'x-api-key': self.from_number.api_key,
+            'x-phone-number': self.from_number.from_field,
+            'origin': origin,
+        }
+        plain_text = html_to_whatsapp_text(self.body)
+        normalize = self.env['whatsapp.mailing.contact']._normalize_phone
+        
+        while partners and not self._out_of_time():
+            granted, wait = self.from_number._acquire_send_tokens(min(len(partners), BULK_SEND_MAX))
+            if not granted:
+                if self._out_of_time(wait):
+                    break
+                _logger.info(f"⏳ [Wizard] Rate limit reached for {self.from_number.display_name}, waiting {wait:.2f}s...")
+                time.sleep(wait)
+                continue
+            
+            chunk, partners = partners[:granted], partners[granted:]
+            messages = []
+            for partner in chunk:
+                message = {'to': normalize(partner.mobile), 'messageType': message_type, 'body': plain_text}
+                if media_ids:
+                    message['mediaIds'] = media_ids
+                messages.append(message)
+            
+            try:
+                results = node_client.send_bulk(headers, messages, timeout=cron_request_timeout(120, deadline))
+            except node_client.BulkSendUnsupported:
+                _logger.info("[Wizard] The WhatsApp service has no bulk endpoint, sending one message per request")
+                self.from_number._release_send_tokens(granted)
+                return done
+            if any(result.get('qr_popup_needed') for result in results):
+                self.from_number._release_send_tokens(granted)
+                return done
+            
+            for partner, result in zip(chunk, results):
+                done['partner_ids'].add(partner.id)
+                if result.get('success'):
+                    done['success_count'] += 1
+                    _logger.info(f"✅ Message sent to {partner.name} ({partner.mobile}) - API confirmed success")
+                    self._notify_recipient_result(partner)
+                else:
+                    done['error_messages'].append(f"{partner.name}: {result.get('error', 'Unknown error')}")
+                    _logger.error(f"❌ Failed to send to {partner.name}: {result.get('error')}")
+                    self._notify_recipient_result(partner, done['error_messages'][-1])
+        
+        return done
+
+    @staticmethod
+    def _post_message(headers, to, message_type, body, media_ids, files, deadline=None):
+        """Post one message to the WhatsApp service
+        
+        Runs in a worker thread of the parallel send, so it only does HTTP and
+        never touches the ORM or the cursor. Sends by media ids when given and
+        falls back to uploading the files if the service no longer has them.
+        
+        Args:
+            files: list of (filename, bytes, mimetype) to send as multipart, or None for a text message
+            deadline: time.monotonic() value at which the compose job's budget ends, caps the request timeouts
+        
+        Returns:
+            tuple: (response, media_expired, exception) - response is None if the request raised
+        """
+        api_url = "http://localhost:3000/api/whatsapp/send"
+        payload = {'to': to, 'messageType': message_type, 'body': body}
+        media_expired = False
+        try:
+            if media_ids:
+                response = requests.post(api_url, json=dict(payload, mediaIds=media_ids), headers=headers, timeout=cron_request_timeout(120, deadline))
+                if response.status_code not in [404, 410]:
+                    return response, False, None
+                media_expired = True
+            
+            if files is not None:
+                # Build multipart form with files, a fresh stream per request
+                _logger.info(f"📤 Sending multipart request with {len(files)} file(s)")
+                response = requests.post(
+                    api_url,
+                    data=payload,
+                    files=[('files', (filename, io.BytesIO(file_data), mimetype)) for filename, file_data, mimetype in files],
+                    headers=headers,
+                    timeout=cron_request_timeout(120, deadline)
+                )
+            else:
+                # Simple JSON body for chat message
+                response = requests.post(api_url, json=payload, headers=headers, timeout=cron_request_timeout(120, deadline))
+            return response, media_expired, None
+        except Exception as e:
+            return None, media_expired, e
+
+    def _send_messages_via_socket(self, origin='127.0.0.1', partners=None):
+        """Send messages via WhatsApp API to backend, to `partners` or all the recipients"""
+        if partners is None:
+            partners = self.partner_ids
         try:
-            import requests
+            import base64
             
             # Send messages to each recipient individually
             success_count = 0
             error_messages = []
             
-            for partner in self.partner_ids:
-                if not partner.mobile:
-                    error_messages.append(f"{partner.name}: No mobile number")
-                    continue
-                    
+            # Decode attachments once, every partner reuses the same bytes
+            prepared_files = []
+            for attachment in self.attachment_ids:
+                file_data = b''
+                
                 try:
-                    # Prepare form data for WhatsApp API
-                    # Strip HTML tags and convert to plain text for WhatsApp
-                    import re
-                    from bs4 import BeautifulSoup
-                    
-                    # Remove HTML tags and convert to plain text
-                    if self.body:
-                        # Use BeautifulSoup to properly strip HTML but preserve spacing
-                        soup = BeautifulSoup(self.body, 'html.parser')
-                        plain_text = soup.get_text(separator=' ')
-                        # Only remove excessive whitespace (3+ spaces) but keep single spaces and line breaks
-                        plain_text = re.sub(r' {3,}', ' ', plain_text)
-                        # Decode HTML entities
-                        plain_text = plain_text.replace('&nbsp;', ' ')
-                        plain_text = plain_text.replace('&amp;', '&')
-                        plain_text = plain_text.replace('&lt;', '<')
-                        plain_text = plain_text.replace('&gt;', '>')
-                        plain_text = plain_text.replace('&quot;', '"')
-                    else:
-                        plain_text = ""
-                    
-                    # print("Plain text content:", plain_text)
-                    # form_data = {
-                    #     'apiKey': self.from_number.api_key or 'd4f3c5577ea1bbde657df1df3c02fa371dd140aa357bf10a90200b71baa37033',
-                    #     'phoneNumber': self.from_number.from_field,
-                    #     'to': partner.mobile,
-                    #     'messageType': 'text',
-                    #     'text': plain_text,
-                    #     'content_type': 'application/json'
-                    # }
-                    # print("form_data**", form_data)
-                    # Determine attachments and message type BEFORE headers/request
-                    has_attachments = bool(self.attachment_ids)
-                    message_type = 'document' if has_attachments else 'chat'
-
-                    # Prepare headers (origin is passed as parameter from action_send_whatsapp)
-                    headers = {
-                        'x-api-key': self.from_number.api_key,
-                        'x-phone-number': self.from_number.from_field,
-                        'origin': origin,  # Use dynamic origin to match socket connection
-                    }
-                    
-                    # Send to WhatsApp API
-                    api_url = "http://localhost:3000/api/whatsapp/send"
-                    # Normalize recipient phone: keep one space after country code, remove others
+                    # Decode attachment.datas (base64 in database)
+                    b64_value = attachment.sudo().datas or ''
                     
-                    raw_phone = (partner.mobile or '')
-                    compact = re.sub(r'\s+', ' ', raw_phone).strip()
-                    m = re.match(r'^(\+\d{1,3})\s*(.*)$', compact)
-                    if m:
-                        cc = m.group(1)
-                        rest = re.sub(r'\s+', '', m.group(2))
-                        normalized_to = f"{cc} {rest}" if rest else cc
-                    else:
-                        normalized_to = re.sub(r'\s+', '', raw_phone)
-                    _logger.debug(f"[Wizard] Normalized phone number for {partner.name}: {normalized_to}")
-
-                    if has_attachments:
-                        # Build multipart form with files
-                        import base64
-                        import io
-                        files = []
+                    if b64_value:
+                        # Handle string/bytes conversion
+                        if isinstance(b64_value, bytes):
+                            b64_value = b64_value.decode('utf-8', errors='ignore')
                         
-                        for attachment in self.attachment_ids:
-                            file_data = b''
-                            
-                            try:
-                                # Decode attachment.datas (base64 in database)
-                                b64_value = attachment.sudo().datas or ''
-                                
-                                if b64_value:
-                                    # Handle string/bytes conversion
-                                    if isinstance(b64_value, bytes):
-                                        b64_value = b64_value.decode('utf-8', errors='ignore')
-                                    
-                                    # Remove data URI prefix if present
-                                    if isinstance(b64_value, str) and b64_value.startswith('data:'):
-                                        b64_value = b64_value.split(',', 1)[1] if ',' in b64_value else b64_value
-                                    
-                                    # Fix base64 padding
-                                    if isinstance(b64_value, str):
-                                        pad = len(b64_value) % 4
-                                        if pad:
-                                            b64_value = b64_value + ('=' * (4 - pad))
-                                        
-                                        file_data = base64.b64decode(b64_value)
-                                        
-                            except Exception as e:
-                                _logger.error(f"❌ [Attachment {attachment.id}] Error decoding attachment: {e}")
-                                continue
+                        # Remove data URI prefix if present
+                        if isinstance(b64_value, str) and b64_value.startswith('data:'):
+                            b64_value = b64_value.split(',', 1)[1] if ',' in b64_value else b64_value
+                        
+                        # Fix base64 padding
+                        if isinstance(b64_value, str):
+                            pad = len(b64_value) % 4
+                            if pad:
+                                b64_value = b64_value + ('=' * (4 - pad))
                             
-                            # Sanitize filename: replace path separators with underscores
-                            # Example: ASPL/2526/09/15039.pdf -> ASPL_2526_09_15039.pdf
-                            raw_name = (attachment.name or 'attachment')
-                            filename = raw_name.replace('/', '_').replace('\\', '_')
-                            mimetype = getattr(attachment, 'mimetype', None) or 'application/octet-stream'
+                            file_data = base64.b64decode(b64_value)
                             
-                            # Force PDF mimetype if filename ends with .pdf
-                            if filename.lower().endswith('.pdf'):
-                                mimetype = 'application/pdf'
-
-                            # Add file if we have actual data
-                            if file_data and len(file_data) > 0:
-                                files.append((
-                                    'files',
-                                    (filename, io.BytesIO(file_data), mimetype)
-                                ))
-                                _logger.info(f"📎 Added attachment: {filename} ({len(file_data)} bytes, {mimetype})")
-                            else:
-                                _logger.warning(f"⚠️ [Attachment {attachment.id}] Skipping: No file data available")
-
-                        form_data = {
-                            'to': normalized_to,
-                            'messageType': message_type,
-                            'body': plain_text,
-                        }
-                        
-                        _logger.info(f"📤 Sending multipart request with {len(files)} file(s)")
+                except Exception as e:
+                    _logger.error(f"❌ [Attachment {attachment.id}] Error decoding attachment: {e}")
+                    continue
+                
+                # Sanitize filename: replace path separators with underscores
+                # Example: ASPL/2526/09/15039.pdf -> ASPL_2526_09_15039.pdf
+                raw_name = (attachment.name or 'attachment')
+                filename = raw_name.replace('/', '_').replace('\\', '_')
+                mimetype = getattr(attachment, 'mimetype', None) or 'application/octet-stream'
+                
+                # Force PDF mimetype if filename ends with .pdf
+                if filename.lower().endswith('.pdf'):
+                    mimetype = 'application/pdf'
 
-                        response = requests.post(
-                            api_url,
-                            data=form_data,
-                            files=files,
-                            headers=headers,
-                            timeout=120
-                        )
-                    else:
-                        # Simple JSON body for chat message
-                        response = requests.post(
-                            api_url,
-                            json={
-                                'to': normalized_to,
-                                'messageType': message_type,
-                                'body': plain_text,
-                            },
-                            headers=headers,
-                            timeout=120
-                        )
-                    _logger.info(f"📡 API Response for {partner.name}: Status={response.status_code}, Body={response.text}")
+                # Add file if we have actual data
+                if file_data and len(file_data) > 0:
+                    prepared_files.append((filename, file_data, mimetype))
+                    _logger.info(f"📎 Added attachment: {filename} ({len(file_data)} bytes, {mimetype})")
+                else:
+                    _logger.warning(f"⚠️ [Attachment {attachment.id}] Skipping: No file data available")
+            
+            uploaded_media_ids = None
+            
+            # Several partners: post them in bulk requests, partners left over (bulk endpoint
+            # missing, QR needed) go through the one-by-one path below
+            bulk_done = self._send_messages_bulk(origin, prepared_files, partners)
+            success_count += bulk_done['success_count']
+            error_messages += bulk_done['error_messages']
+            
+            remaining = []
+            for partner in partners:
+                if partner.id in bulk_done['partner_ids']:
+                    continue
+                if not partner.mobile:
+                    error_messages.append(f"{partner.name}: No mobile number")
+                    self._notify_recipient_result(partner, error_messages[-1])
+                    continue
+                remaining.append(partner)
+            
+            # Convert HTML body to WhatsApp text (memoized, parsed once per body)
+            plain_text = html_to_whatsapp_text(self.body)
+            has_attachments = bool(self.attachment_ids)
+            message_type = 'document' if has_attachments else 'chat'
+            
+            # Prepare headers (origin is passed as parameter from action_send_whatsapp)
+            headers = {
+                'x-api-key': self.from_number.api_key,
+                'x-phone-number': self.from_number.from_field,
+                'origin': origin,  # Use dynamic origin to match socket connection
+            }
+            normalize = self.env['whatsapp.mailing.contact']._normalize_phone
+            deadline = self.env.context.get('compose_job_deadline')
+            pending_qr_popup = None
+            
+            while remaining and not self._out_of_time():
+                # Pace sends through the connection's shared token bucket
+                granted, wait = self.from_number._acquire_send_tokens(min(len(remaining), BULK_SEND_MAX))
+                if not granted:
+                    if self._out_of_time(wait):
+                        break
+                    _logger.info(f"⏳ [Wizard] Rate limit reached for {self.from_number.display_name}, waiting {wait:.2f}s...")
+                    time.sleep(wait)
+                    continue
+                chunk, remaining = remaining[:granted], remaining[granted:]
+                
+                media_ids = None
+                if has_attachments:
+                    # Upload once per connection, every partner is then sent the same media ids
+                    if uploaded_media_ids is None:
+                        uploaded_media_ids = self.env['whatsapp.media.upload']._get_media_ids(
+                            self.from_number, prepared_files, message_type, deadline=deadline
+                        ) or []
+                    media_ids = uploaded_media_ids
+                
+                # The requests of the chunk run in parallel, bounded by the connection's concurrency
+                calls = [
+                    functools.partial(
+                        self._post_message, headers, normalize(partner.mobile), message_type,
+                        plain_text, media_ids, prepared_files if has_attachments else None, deadline
+                    )
+                    for partner in chunk
+                ]
+                outcomes = node_client.run_parallel(
+                    self.from_number.id, self.from_number.rate_limit_concurrency, calls
+                )
+                
+                for partner, (response, media_expired, request_error) in zip(chunk, outcomes):
+                    if media_expired and uploaded_media_ids:
+                        # The service dropped the media: forget it and send the files from now on
+                        _logger.warning(f"⚠️ [Wizard] Media {uploaded_media_ids} expired on the service, falling back to file upload")
+                        self.env['whatsapp.media.upload']._forget(self.from_number, prepared_files)
+                        uploaded_media_ids = []
                     
-                    # Accept both 200 and 201 as success (201 = QR code required)
-                    if response.status_code in [200, 201]:
-                        _logger.info(f"📱 [Wizard] Response data: {response.status_code}")
-                        # MAIN PATH ONLY: strictly parse JSON; treat invalid JSON as error
-                        try:
-                            response_data = response.json()
-                        except Exception as json_error:
-                            error_msg = f"{partner.name}: Invalid JSON from API - {json_error}"
-                            error_messages.append(error_msg)
-                            _logger.error(f"❌ {error_msg}. Raw: {response.text}")
-                            continue
-
-                        # If API signals a QR is required (201 status or qrCode in response), open popup and return immediately
-                        # Check for QR code in response data (could be at top level or nested in 'data')
-                        qr_code_in_response = response_data.get('qrCode') or (
-                            response_data.get('data', {}).get('qrCode') if response_data.get('data') else None
-                        )
+                    sent_before, failed_before = success_count, len(error_messages)
+                    try:
+                        if request_error:
+                            raise request_error
+                        _logger.info(f"📡 API Response for {partner.name}: Status={response.status_code}, Body={response.text}")
                         
-                        if qr_code_in_response:
-                            _logger.info(f"📱 [Wizard] QR code required for partner: {partner.name}")
-                            
-                            qr_code_data_url = qr_code_in_response
-                            if isinstance(qr_code_data_url, str) and qr_code_data_url.startswith('data:image'):
-                                qr_code_base64 = qr_code_data_url
-                            else:
-                                qr_code_base64 = qr_code_data_url
+                        # Accept both 200 and 201 as success (201 = QR code required)
+                        if response.status_code in [200, 201]:
+                            _logger.info(f"📱 [Wizard] Response data: {response.status_code}")
+                            # MAIN PATH ONLY: strictly parse JSON; treat invalid JSON as error
+                            try:
+                                response_data = response.json()
+                            except Exception as json_error:
+                                error_msg = f"{partner.name}: Invalid JSON from API - {json_error}"
+                                error_messages.append(error_msg)
+                                _logger.error(f"❌ {error_msg}. Raw: {response.text}")
+                                continue
 
-                            _logger.info(f"📱 [Wizard] QR code data length: {len(qr_code_base64) if qr_code_base64 else 0}")
-                            
-                            _logger.info(f"📱 [Wizard] Creating QR popup with API key: {self.from_number.api_key[:10] if self.from_number.api_key else 'None'}...")
-                            _logger.info(f"📱 [Wizard] Phone number: {self.from_number.from_field}")
+                            # If API signals a QR is required (201 status or qrCode in response), open popup and return immediately
+                            # Check for QR code in response data (could be at top level or nested in 'data')
+                            qr_code_in_response = response_data.get('qrCode') or (
+                                response_data.get('data', {}).get('qrCode') if response_data.get('data') else None
+                            )
                             
-                            # Store context for later chatter logging
-                            active_model = self.model or self.env.context.get('active_model')
-                            active_id = self.env.context.get('active_id')
-                            
-                            qr_popup = self.env['whatsapp.qr.popup'].create({
-                                'qr_code_image': qr_code_base64,
-                                'qr_code_filename': 'whatsapp_qr_code.png',
-                                'from_number': self.from_number.from_field,
-                                'from_name': self.from_number.name,
-                                'original_wizard_id': self.id,
-                                'message': response_data.get('message', 'Please scan QR code to connect WhatsApp'),
-                                'api_key': self.from_number.api_key,
-                                'phone_number': self.from_number.from_field,
-                                'qr_expires_at': fields.Datetime.now() + timedelta(seconds=120),  # 2 minutes
-                                'countdown_seconds': 120,
-                                'is_expired': False,
-                                'retry_count': 0,
-                                'last_qr_string': qr_code_base64[:100] if qr_code_base64 else '',
-                                # Store context for chatter logging
-                                'original_context': json.dumps(self.env.context),
-                                'active_model': active_model or '',
-                                'active_id': active_id or 0,
-                            })
-                            self.qr_popup_id = qr_popup.id
-                            self.write({'qr_popup_id': qr_popup.id})
-                            _logger.info(f"📱 [Wizard] QR popup created successfully. ID={qr_popup.id}")
-                            
-                            # Note: We return early here when QR is needed. After QR authentication,
-                            # action_close_qr_popup() will call _send_messages_via_socket() again,
-                            # which will process ALL recipients (self.partner_ids) from the beginning.
-                            # This ensures all recipients get the message after authentication.
-                            return {
-                                'qr_popup_needed': True,
-                                'qr_popup_id': qr_popup.id,
-                                'success_count': 0,
-                                'error_count': 0,
-                                'error_messages': [],
-                            }
+                            if qr_code_in_response:
+                                _logger.info(f"📱 [Wizard] QR code required for partner: {partner.name}")
+                                if pending_qr_popup:
+                                    # Another message of the chunk already asked for the QR code
+                                    continue
+                                
+                                qr_code_data_url = qr_code_in_response
+                                if isinstance(qr_code_data_url, str) and qr_code_data_url.startswith('data:image'):
+                                    qr_code_base64 = qr_code_data_url
+                                else:
+                                    qr_code_base64 = qr_code_data_url
 
-                        # Log the actual response data for debugging
-                        _logger.info(f"🔍 [Wizard] Response data for {partner.name}: {response_data}")
-                        _logger.info(f"🔍 [Wizard] QR code found: {bool(qr_code_in_response)}")
-                        
-                        # No QR required: rely on success flag
-                        if response_data.get('success', False):
-                            # Double check: if we get success without QR, log it
-                            if not qr_code_in_response:
-                                _logger.warning(f"⚠️ [Wizard] API returned success=true without QR code for {partner.name}")
-                                _logger.warning(f"⚠️ [Wizard] This might indicate an issue. Response: {response_data}")
+                                _logger.info(f"📱 [Wizard] QR code data length: {len(qr_code_base64) if qr_code_base64 else 0}")
+                                
+                                _logger.info(f"📱 [Wizard] Creating QR popup with API key: {self.from_number.api_key[:10] if self.from_number.api_key else 'None'}...")
+                                _logger.info(f"📱 [Wizard] Phone number: {self.from_number.from_field}")
+                                
+                                # Store context for later chatter logging
+                                active_model = self.model or self.env.context.get('active_model')
+                                active_id = self.env.context.get('active_id')
+                                
+                                qr_popup = self.env['whatsapp.qr.popup'].create({
+                                    'qr_code_image': qr_code_base64,
+                                    'qr_code_filename': 'whatsapp_qr_code.png',
+                                    'from_number': self.from_number.from_field,
+                                    'from_name': self.from_number.name,
+                                    'original_wizard_id': self.id,
+                                    'message': response_data.get('message', 'Please scan QR code to connect WhatsApp'),
+                                    'api_key': self.from_number.api_key,
+                                    'phone_number': self.from_number.from_field,
+                                    'qr_expires_at': fields.Datetime.now() + timedelta(seconds=120),  # 2 minutes
+                                    'countdown_seconds': 120,
+                                    'is_expired': False,
+                                    'retry_count': 0,
+                                    'last_qr_string': qr_code_base64[:100] if qr_code_base64 else '',
+                                    # Store context for chatter logging
+                                    'original_context': json.dumps(self.env.context),
+                                    'active_model': active_model or '',
+                                    'active_id': active_id or 0,
+                                })
+                                self.qr_popup_id = qr_popup.id
+                                self.write({'qr_popup_id': qr_popup.id})
+                                _logger.info(f"📱 [Wizard] QR popup created successfully. ID={qr_popup.id}")
+                                
+                                # The other requests of the chunk were already posted: their outcomes
+                                # are still counted, then sending stops until the QR code is scanned.
+                                # action_close_qr_popup() sends to the recipients not processed yet.
+                                pending_qr_popup = qr_popup
+                                continue
+
+                            # Log the actual response data for debugging
+                            _logger.info(f"🔍 [Wizard] Response data for {partner.name}: {response_data}")
+                            _logger.info(f"🔍 [Wizard] QR code found: {bool(qr_code_in_response)}")
                             
-                            success_count += 1
-                            _logger.info(f"✅ Message sent to {partner.name} ({partner.mobile}) - API confirmed success")
+                            # No QR required: rely on success flag
+                            if response_data.get('success', False):
+                                # Double check: if we get success without QR, log it
+                                if not qr_code_in_response:
+                                    _logger.warning(f"⚠️ [Wizard] API returned success=true without QR code for {partner.name}")
+                                    _logger.warning(f"⚠️ [Wizard] This might indicate an issue. Response: {response_data}")
+                                
+                                success_count += 1
+                                _logger.info(f"✅ Message sent to {partner.name} ({partner.mobile}) - API confirmed success")
+                            else:
+                                # Extract error message from response
+                                error_detail = response_data.get('error', response_data.get('message', 'Unknown error'))
+                                if isinstance(error_detail, dict):
+                                    error_detail = error_detail.get('message', str(error_detail))
+                                
+                                error_msg = f"{partner.name}: {error_detail}"
+                                error_messages.append(error_msg)
+                                _logger.error(f"❌ API returned success=false for {partner.name}: {error_detail}")
+                                _logger.error(f"❌ Full response: {response_data}")
                         else:
-                            # Extract error message from response
-                            error_detail = response_data.get('error', response_data.get('message', 'Unknown error'))
-                            if isinstance(error_detail, dict):
-                                error_detail = error_detail.get('message', str(error_detail))
+                            # Try to extract error message from response
+                            error_detail = "Unknown error"
+                            try:
+                                error_response = response.json()
+                                error_detail = error_response.get('error', error_response.get('message', error_response.get('data', {}).get('message', 'Unknown error')))
+                                if isinstance(error_detail, dict):
+                                    error_detail = error_detail.get('message', str(error_detail))
+                            except:
+                                # If response is not JSON, use the text
+                                error_detail = response.text[:200] if response.text else "Unknown error"
                             
                             error_msg = f"{partner.name}: {error_detail}"
                             error_messages.append(error_msg)
-                            _logger.error(f"❌ API returned success=false for {partner.name}: {error_detail}")
-                            _logger.error(f"❌ Full response: {response_data}")
-                    else:
-                        # Try to extract error message from response
-                        error_detail = "Unknown error"
-                        try:
-                            error_response = response.json()
-                            error_detail = error_response.get('error', error_response.get('message', error_response.get('data', {}).get('message', 'Unknown error')))
-                            if isinstance(error_detail, dict):
-                                error_detail = error_detail.get('message', str(error_detail))
-                        except:
-                            # If response is not JSON, use the text
-                            error_detail = response.text[:200] if response.text else "Unknown error"
-                        
-                        error_msg = f"{partner.name}: {error_detail}"
+                            _logger.error(f"❌ Failed to send to {partner.name}: Status {response.status_code} - {error_detail}")
+                            _logger.error(f"❌ Full response: {response.text}")
+                    
+                    except Exception as e:
+                        error_msg = f"{partner.name}: {str(e)}"
                         error_messages.append(error_msg)
-                        _logger.error(f"❌ Failed to send to {partner.name}: Status {response.status_code} - {error_detail}")
-                        _logger.error(f"❌ Full response: {response.text}")
-                        
-                except Exception as e:
-                    error_msg = f"{partner.name}: {str(e)}"
-                    error_messages.append(error_msg)
-                    _logger.exception(f"❌ Error sending to {partner.name}: {e}")
+                        _logger.exception(f"❌ Error sending to {partner.name}: {e}")
+                    finally:
+                        if success_count > sent_before:
+                            self._notify_recipient_result(partner)
+                        elif len(error_messages) > failed_before:
+                            self._notify_recipient_result(partner, error_messages[-1])
+                
+                if pending_qr_popup:
+                    return {
+                        'qr_popup_needed': True,
+                        'qr_popup_id': pending_qr_popup.id,
+                        'success_count': success_count,
+                        'error_count': len(error_messages),
+                        'error_messages': error_messages,
+                    }
             
             # Log results
             if success_count > 0:
@@ -923,33 +1160,49 @@ class WhatsappCompose(models.TransientModel):
     #     }
     def action_close_qr_popup(self, popup=False):
         self.ensure_one()
-        print("Popupppppppppp", popup)
 
-        result = self._send_messages_via_socket()
+        qr_popup = popup or self.env['whatsapp.qr.popup'].search([
+            ('original_wizard_id', '=', self.id)
+        ], order='create_date desc', limit=1)
+        # Restore the context of the original send for the chatter and the background job
+        wizard = self
+        if qr_popup and qr_popup.original_context:
+            try:
+                ctx = json.loads(qr_popup.original_context)
+                # The deadline of a background job run has passed by now
+                ctx.pop('compose_job_deadline', None)
+                ctx.update({
+                    'active_model': qr_popup.active_model,
+                    'active_id': qr_popup.active_id,
+                })
+                wizard = self.with_context(**ctx)
+            except Exception as e:
+                _logger.warning(f"⚠️ [Wizard] Could not restore the original context: {e}")
+
+        # Recipients processed before the QR code was asked for are not sent again
+        partners = self.partner_ids - self.done_partner_ids
+        job = self.env['whatsapp.compose.job'].browse(wizard.env.context.get('compose_job_id')).exists()
+        if job:
+            # Sent by a background job: it resumes with its own recipients left
+            job._resume()
+            partners = job.partner_ids - job.done_partner_ids
+            result = {'success_count': 0, 'error_count': 0, 'error_messages': [], 'queued': True}
+        elif len(partners) > 1:
+            # Several recipients: the background job sends them, as from the Send button
+            wizard._queue_compose_job('127.0.0.1', partners)
+            result = {'success_count': 0, 'error_count': 0, 'error_messages': [], 'queued': True}
+        else:
+            result = wizard._send_messages_via_socket(partners=partners)
 
         # Log in chatter
         if result.get('success_count', 0) > 0:
-            qr_popup = popup or self.env['whatsapp.qr.popup'].search([
-                ('original_wizard_id', '=', self.id)
-            ], order='create_date desc', limit=1)
-
-            if qr_popup and qr_popup.original_context:
-                try:
-                    ctx = json.loads(qr_popup.original_context)
-                    ctx.update({
-                        'active_model': qr_popup.active_model,
-                        'active_id': qr_popup.active_id,
-                    })
-                    self.with_context(**ctx)._log_in_chatter(
-                        [p.name for p in self.partner_ids], []
-                    )
-                except Exception as e:
-                    self._log_in_chatter([p.name for p in self.partner_ids], [])
-            else:
-                self._log_in_chatter([p.name for p in self.partner_ids], [])
+            wizard._log_in_chatter([p.name for p in partners], [])
 
         # Build message
-        if result['success_count'] > 0:
+        if result.get('queued'):
+            message = _("Sending to %d recipients in the background, results appear as they are sent.") % len(partners)
+            notif_type = "info"
+        elif result['success_count'] > 0:
             message = result['error_count'] > 0 \
                 and _("%d sent, %d failed: %s") % (result['success_count'], result['error_count'], ', '.join(result['error_messages'])) \
                 or _("Successfully sent %d messages!") % result['success_count']
@@ -974,7 +1227,7 @@ class WhatsappCompose(models.TransientModel):
             'message': message,
             'type': notif_type,
             'sticky': False,
-            'success': result['success_count'] > 0
+            'success': result['success_count'] > 0 or bool(result.get('queued'))
         }
         
         dbname = self._cr.dbname
@@ -401,6 +401,7 @@ class WhatsAppQRPopup(models.TransientModel):
                                 # Test wizard was closed, use stored data
                                 _logger.info(f"✅ [QR Popup] Test wizard closed, using stored test data")
                                 if popup.test_campaign_id and popup.test_phone_to:
+                                    popup.test_campaign_id.from_connection_id._wait_send_token(context_name="QR Test")
                                     result = popup.test_campaign_id._send_to_recipient_via_api(
                                         popup.test_phone_to.strip(),
                                         'Test Recipient',
@@ -414,6 +415,7 @@ class WhatsAppQRPopup(models.TransientModel):
                             # Fallback: try using stored test data
                             if popup.test_campaign_id and popup.test_phone_to:
                                 try:
+                                    popup.test_campaign_id.from_connection_id._wait_send_token(context_name="QR Test")
                                     popup.test_campaign_id._send_to_recipient_via_api(
                                         popup.test_phone_to.strip(),
                                         'Test Recipient',
@@ -427,6 +429,7 @@ class WhatsAppQRPopup(models.TransientModel):
                         _logger.info(f"✅ [QR Popup] Using stored test data (wizard not available)")
                         if popup.test_campaign_id and popup.test_phone_to:
                             try:
+                                popup.test_campaign_id.from_connection_id._wait_send_token(context_name="QR Test")
                                 result = popup.test_campaign_id._send_to_recipient_via_api(
                                     popup.test_phone_to.strip(),
                                     'Test Recipient',